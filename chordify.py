@@ -152,7 +152,9 @@ _pitch_delta_chord_interval_dictionary = {0: '(8)',
                                          6: '(#11)',
                                          8: '(b13)',
                                          9: '(13)',
-                                        10:'(#13)'}
+                                        10:'(#13)',
+                                         7: '(5)',         # (for a diminished or augmented fifth chord)
+                                        11: '(M7)'}
 
 class Chord:
     def __init__(self, root):
@@ -272,111 +274,122 @@ _ab7 = PNote(68 + 36)
 def chordify_pitch_list(pitch_ordered_list):
     return chordify(pitch_sequence_to_pnote_sequence(pitch_ordered_list))
 
-def chordify(note_ordered_list):
-    match len(note_ordered_list):
-        case [0, 1, 2]:
-            raise RuntimeError('A chord has least 3 notes and this list has only ' + str(len(note_ordered_list)))
-        case 3:
-            is_triad = True
-            third_interval = None
-        case _:
-            is_triad = False
-    current_note_ordered_list = note_ordered_list
-    _is_stack_of_thirds_found = False
-    number_of_remaining_inversions = len(note_ordered_list)
-    while number_of_remaining_inversions > 0:
-        first_interval = current_note_ordered_list[0].interval(current_note_ordered_list[1])
-        if isinstance(first_interval, Third):       # or isinstance(first_interval, Perfect_Fourth):
-            second_interval = current_note_ordered_list[1].interval(current_note_ordered_list[2])
-            if isinstance(second_interval, Third):
-                if is_triad:
-                    _is_stack_of_thirds_found = True
-                    break
-                else:
-                    third_interval = current_note_ordered_list[2].interval(current_note_ordered_list[3])
-                    if isinstance(third_interval, Third):
-                        _is_stack_of_thirds_found = True
-                        break
-        highest_note = current_note_ordered_list[-1]
-        lowest_note = current_note_ordered_list[0]
-        while highest_note.pitch >= lowest_note.pitch:
-            highest_note = highest_note.one_octave_down()
-        current_note_ordered_list = [highest_note] + current_note_ordered_list[:-1]
-        number_of_remaining_inversions -= 1
-    if _is_stack_of_thirds_found:
-        if is_triad:
-            index_extended_note_list = 3
+# Table-driven chord naming
+# A pitch class set is a 12 bits integer (bit k for pitch class k)
+# Thirds are intervals of 3 (minor) or 4 (major) semitones
+
+_chord_class_dictionary =               {(4, 3): Major_Chord,
+                                         (3, 4): Minor_Chord,
+                                         (4, 4): Augmented_Chord,
+                                         (3, 3): Minor_Diminished,
+                                         (4, 4, 4): Augmented_Chord,    # + Unison Octave up
+                                         (4, 4, 3): Augmented_Fifth_Major_Seventh_Chord,
+                                         (4, 3, 4): Major_Major_Seventh_Chord,
+                                         (4, 3, 3): Major_Minor_Seventh_Chord,
+                                         (3, 4, 4): Minor_Major_Seventh_Chord,
+                                         (3, 4, 3): Minor_Minor_Seventh_Chord,
+                                         (3, 3, 4): Semi_Diminished_Chord,
+                                         (3, 3, 3): Diminished_Chord}
+
+def pitch_class_set_from_pitch_list(pitch_list):
+    pitch_class_set = 0
+    for pitch in pitch_list:
+        pitch_class_set |= 1 << (pitch % 12)
+    return pitch_class_set
+
+def stack_of_thirds_list(pitch_class_set, number_of_intervals):     # Returns the list of (root pitch class, intervals) of the stacks of thirds within a pitch class set
+    stack_list = []
+    for root in range(12):
+        if pitch_class_set & (1 << root):
+            for intervals in _chord_class_dictionary:
+                if len(intervals) == number_of_intervals:
+                    pitch_class = root
+                    is_within_set = True
+                    for interval in intervals:
+                        pitch_class = (pitch_class + interval) % 12
+                        if not pitch_class_set & (1 << pitch_class):
+                            is_within_set = False
+                            break
+                    if is_within_set:
+                        stack_list.append((root, intervals))
+    return stack_list
+
+def build_chord_table():                # Precomputed, for each of the 4096 pitch class sets: (chord class, root pitch class, extension pitch class tuple) or None
+                                        # and whether it contains some stack of 2 (triad) or of 3 thirds (used to reject at once chords which cannot be named)
+    chord_table = [None] * 4096
+    triad_stack_table = [False] * 4096
+    tetrad_stack_table = [False] * 4096
+    for pitch_class_set in range(4096):
+        triad_stack_list = stack_of_thirds_list(pitch_class_set, 2)
+        tetrad_stack_list = stack_of_thirds_list(pitch_class_set, 3)
+        triad_stack_table[pitch_class_set] = bool(triad_stack_list)
+        tetrad_stack_table[pitch_class_set] = bool(tetrad_stack_list)
+        if bin(pitch_class_set).count('1') >= 4 and tetrad_stack_list:
+            (root, intervals) = tetrad_stack_list[0]
+        elif bin(pitch_class_set).count('1') == 3 and triad_stack_list:
+            (root, intervals) = triad_stack_list[0]
         else:
-            index_extended_note_list = 4
-        return chord_from_intervals(first_interval, second_interval, third_interval), interval_list_from_note_list(first_interval.low, current_note_ordered_list[index_extended_note_list:])
-    else:
-        print('Warning: Cannot name a chord corresponding to the following notes: ' + str(note_ordered_list))
-        return Unknown_Chord(PNote(first_interval.low)), []
-
-def chord_from_intervals(first_interval, second_interval, third_interval):
-    root = first_interval.low
-    class_first_interval = type(first_interval)
-    class_second_interval = type(second_interval)
-    if not third_interval:
-        if class_first_interval == Major_Third:
-            if class_second_interval == Major_Third:
-                return Augmented_Chord(PNote(root))
-            elif class_second_interval == Minor_Third:
-                return Major_Chord(PNote(root))
-            else:
-                return Chord(PNote(root))
-        elif class_first_interval == Minor_Third:
-            if class_second_interval == Major_Third:
-                return Minor_Chord(PNote(root))
-            elif class_second_interval == Minor_Third:
-                return Minor_Diminished(PNote(root))
-            else:
-                return Chord(PNote(root))
+            continue
+        stack_pitch_class_set = 1 << root
+        pitch_class = root
+        for interval in intervals:
+            pitch_class = (pitch_class + interval) % 12
+            stack_pitch_class_set |= 1 << pitch_class
+        extension_list = []
+        for delta in range(1, 12):
+            if pitch_class_set & ~stack_pitch_class_set & (1 << ((root + delta) % 12)):
+                extension_list.append(delta)
+        chord_table[pitch_class_set] = (_chord_class_dictionary[intervals], root, tuple(extension_list))
+    return chord_table, triad_stack_table, tetrad_stack_table
+
+_chord_table, _triad_stack_table, _tetrad_stack_table = build_chord_table()
+
+def chordify_pitch_class_set(pitch_class_set):     # One lookup (e.g., for every onset in real time), independent of the voicing
+                                                    # Root is the lowest pitch class (from C) among the possible ones
+    entry = _chord_table[pitch_class_set]
+    if entry is None:
+        return None
+    (chord_class, root, extension_list) = entry
+    return chord_class(PNote(root)), [_pitch_delta_chord_interval_dictionary[delta] for delta in extension_list]
+
+def chordify(note_ordered_list):        # Same results as searching (first with the notes as ordered, then with each inversion: highest note moved one octave down below the lowest)
+                                        # for a stack of thirds within the 3 (triad) or 4 first notes, but with integers only
+    note_number = len(note_ordered_list)
+    if note_number < 3:
+        raise RuntimeError('A chord has least 3 notes and this list has only ' + str(note_number))
+    pitch_list = [note.pitch for note in note_ordered_list]
+    if note_number == 3:
+        number_of_intervals = 2
+        is_stack_possible = _triad_stack_table[pitch_class_set_from_pitch_list(pitch_list)]
     else:
-        class_third_interval = type(third_interval)
-        if class_first_interval == Major_Third:
-            if class_second_interval == Major_Third:
-                if class_third_interval == Major_Third:
-                    return Augmented_Chord(PNote(root))  # + Unison Octave up
-                elif class_third_interval == Minor_Third:
-                    return Augmented_Major_Seventh_Chord(PNote(root))
-                else:
-                    return Chord(PNote(root))
-            elif class_second_interval == Minor_Third:
-                if class_third_interval == Major_Third:
-                    return Major_Major_Seventh_Chord(PNote(root))
-                elif class_third_interval == Minor_Third:
-                    return Major_Minor_Seventh_Chord(PNote(root))
-                else:
-                    return Chord(PNote(root))
-            else:
-                return Major_Chord(PNote(root))
-        elif class_first_interval == Minor_Third:
-            if class_second_interval == Major_Third:
-                if class_third_interval == Major_Third:
-                    return Minor_Major_Seventh_Chord(PNote(root))
-                elif class_third_interval == Minor_Third:
-                    return Minor_Minor_Seventh_Chord(PNote(root))
-                else:
-                    return Major_Chord(PNote(root))
-            elif class_second_interval == Minor_Third:
-                if class_third_interval == Major_Third:
-                    return Semi_Diminished_Chord(PNote(root))
-                elif class_third_interval == Minor_Third:
-                    return Diminished_Chord(PNote(root))
-                else:
-                    return Chord(PNote(root))
-        else:
-            return Chord(PNote(root))
-
-def interval_list_from_note_list(root, extended_note_list):
-    if not extended_note_list:
-        return []
-    else:
-        return [interval_from_notes(root, extended_note_list[0])] + interval_list_from_note_list(root, extended_note_list[1:])
-
-def interval_from_notes(low, high):
-    return _pitch_delta_chord_interval_dictionary[(high.pitch - low)%12]
+        number_of_intervals = 3
+        is_stack_possible = _tetrad_stack_table[pitch_class_set_from_pitch_list(pitch_list)]
+    if is_stack_possible:
+        for inversion in range(note_number):        # After k inversions, notes are (circularly) ordered from the (N-k)th one
+            start = (note_number - inversion) % note_number
+            intervals = []
+            for k in range(number_of_intervals):
+                interval = (pitch_list[(start + k + 1) % note_number] - pitch_list[(start + k) % note_number]) % 12
+                if interval != 3 and interval != 4:
+                    break
+                intervals.append(interval)
+            if len(intervals) == number_of_intervals:
+                root = lowered_first_pitch(pitch_list, inversion)
+                extension_list = []
+                for k in range(number_of_intervals + 1, note_number):
+                    extension_list.append(_pitch_delta_chord_interval_dictionary[(pitch_list[(start + k) % note_number] - root) % 12])
+                return _chord_class_dictionary[tuple(intervals)](PNote(root)), extension_list
+    print('Warning: Cannot name a chord corresponding to the following notes: ' + str(note_ordered_list))
+    return Unknown_Chord(PNote(lowered_first_pitch(pitch_list, note_number - 1))), []
+
+def lowered_first_pitch(pitch_list, inversion):     # Pitch of the first note after some number of inversions (highest note moved octaves down below the lowest)
+    lowest_pitch = pitch_list[0]
+    for k in range(1, inversion + 1):
+        pitch = pitch_list[-k]
+        while pitch >= lowest_pitch:
+            pitch -= 12
+        lowest_pitch = pitch
+    return lowest_pitch
 
 #match Minor_Third(low=1, high=2), Major_Third(low=1, high=2):
 #    case Major_Third(low=x, high=y), Minor_Third(low=z, high=t):
@@ -16,14 +16,26 @@
 # My thanks to Francois for his continuous feedback.
 
 import argparse
+import array
 import ast
+import atexit
+import bisect
+import collections
+import copy
+import heapq
+import math
+import queue
 import random
+import sys
+import threading
 import time
+import weakref
 import mido
 from mido import MidiTrack, Message, open_input, open_output, get_input_names, get_output_names
 import os
 import pickle
 from metrics import save_played_notes, display_metrics_history
+from viewpoints import viewpoint_from_name
 
 # constants
 _min_midi_pitch = 0
@@ -32,80 +44,254 @@ _max_midi_velocity = 64
 _long = 5000
 _pseudo_infinite = 100000
 _default_pseudo_max_order = 15
+_chord_key_offset = 256                 # Keys of chord tokens (offset + pitch class set), distinct from pitches
 
 # call arguments
 parser = argparse.ArgumentParser()
 parser.add_argument('--t', dest='arg_key_transposition_semi_tones', default=0, type=int, help='Transposition - 0 (default) or positive integer number of semitones (above and below)')
 parser.add_argument('--n', dest='arg_key_max_continuation_notes_number', default=-1, type=int, help='Maximum number of notes of a generated continuation, an integer - if negative (default), without maximum/limitation')
-parser.add_argument('--m', dest='arg_key_generation_mode', required=True, type=str, help='Generation mode: RealTime, File, or Batch')
+parser.add_argument('--m', dest='arg_key_generation_mode', required=True, type=str, help='Generation mode: RealTime, MultiPlayer, File, Batch, Benchmark, or Replay')
 parser.add_argument('--r', dest='arg_key_first_continuation_default_random_generation_mode', default=True, type=bool, help='Random generation (among continuations) if first note generation fails (default = True)')
 parser.add_argument('--p', dest='arg_key_max_played_notes_considered', default=-1, type=int, help='Maximum number of (most recent) played notes considered for training, an integer - if negative (default), without maximum/limitation')
 parser.add_argument('--o', dest='arg_key_pseudo_max_order', default=_default_pseudo_max_order, type=int, help='Pseudo Markov maximum order (maximum sequence of notes considered) for each generation of next continuation note')
+parser.add_argument('--e', dest='arg_key_generation_engine', default='Deepest', type=str, help='Generation engine: Deepest (default) or Backoff')
+parser.add_argument('--v', dest='arg_key_viewpoints', default='Pitch', type=str, help='Viewpoints used for matching, in fallback order, separated by commas, e.g. Pitch+Duration+Velocity,Pitch,Chroma (default = Pitch)')
+parser.add_argument('--c', dest='arg_key_chord_onset_threshold', default=0., type=float, help='Maximum onset delta (in seconds) of notes grouped into a chord token - 0 (default) for no chord tokens')
+parser.add_argument('--f', dest='arg_key_root_fallback_mode', default='Random', type=str, help='Fallback if no root matches the last note: Random (default) or Transpose (to the nearest root)')
+parser.add_argument('--w', dest='arg_key_window_notes_number', default=-1, type=int, help='Sliding window: number of (most recent) played notes reflected by the memory - if negative (default), without window')
+parser.add_argument('--radix', dest='arg_key_path_compression_mode', action='store_true', help='Path compressed (radix) pitch tree: chains of single children stored as single nodes')
+parser.add_argument('--b', dest='arg_key_note_latency_budget', default=0., type=float, help='Latency budget (in milliseconds) for the generation of each note - 0 (default) for none')
+parser.add_argument('--region', dest='arg_key_pitch_region_width', default=0., type=float, help='Pitch region: width (in semitones) around the pitches played favoured when sampling - 0 (default) for none')
+parser.add_argument('--bias', dest='arg_key_recency_bias', default=0., type=float, help='Recency bias: extra weight of the continuations learnt recently when sampling - 0 (default) for none')
+parser.add_argument('--shard', dest='arg_key_sharded_memory_mode', action='store_true', help='Sharded memory: read lazily (one shard per root) from PreMemory.shards and saved into PostMemory.shards')
+parser.add_argument('--mono', dest='arg_key_monophonic_mode', action='store_true', help='Monophonic mode: each continuation note starts when the previous one ends')
+parser.add_argument('--seed', dest='arg_key_seed', default=None, type=int, help='Seed from which the seeds of the generations are drawn - if not specified (default), not reproducible')
+parser.add_argument('--g', dest='arg_key_generation_record_file_name', default=None, type=str, help='File where generations (memory, seed and input) are recorded, and from which they are replayed in Replay mode')
+parser.add_argument('--stop', dest='arg_key_stop_controls', default='note:28', type=str, help='Stop controls, separated by commas: note:<pitch> or cc:<controller> (default = note:28)')
+parser.add_argument('--s', dest='arg_key_multi_player_memory_mode', default='Shared', type=str, help='Memory of the players in MultiPlayer mode: Shared (default) or Isolated')
 
-args = parser.parse_args()
+def configure(argument_list):               # Sets (and checks) the arguments hyperparameters from call arguments (e.g., sys.argv[1:])
+                                            # Called when run as a command, or by a front end (e.g., continuator_server.py) with its own arguments
+                                            # before creating a Continuator, otherwise (imported as a module) default arguments are used
+    global args, _generation_mode, _key_transposition_semi_tones, _max_continuation_notes_number, _first_continuation_default_random_generation_mode, \
+        _max_played_notes_considered, _pseudo_max_order, _generation_engine, _viewpoint_name_list, _chord_onset_threshold, _root_fallback_mode, \
+        _window_notes_number, _path_compression_mode, _note_latency_budget, _pitch_region_width, _recency_bias, _sharded_memory_mode, _monophonic_mode, \
+        _seed, _generation_record_file_name, _multi_player_memory_mode, _stop_control_list, _generation_mode_set, _stop_note_set, _stop_control_set, \
+        _training_max_depth, _time_base
+    args = parser.parse_args(argument_list)
 
-# arguments hyperparameters
+    # arguments hyperparameters
 
-_generation_mode = args.arg_key_generation_mode         # Mode of generation
+    _generation_mode = args.arg_key_generation_mode         # Mode of generation
 
-_key_transposition_semi_tones = args.arg_key_transposition_semi_tones
-                                                        # Transposition into N semitones above and N-1 below.
-                                                        # If N = 0, there is no transposition.
-                                                        # If N = 6, this corresponds to a full transposition into the other 11 keys.
-                                                        # If N >> 6, this corresponds to also transposition into octaves.
-                                                        # N will be truncated by the max and min MIDI pitch values, thus N is arbitrary
+    _key_transposition_semi_tones = args.arg_key_transposition_semi_tones
+                                                            # Transposition into N semitones above and N-1 below.
+                                                            # If N = 0, there is no transposition.
+                                                            # If N = 6, this corresponds to a full transposition into the other 11 keys.
+                                                            # If N >> 6, this corresponds to also transposition into octaves.
+                                                            # N will be truncated by the max and min MIDI pitch values, thus N is arbitrary
 
-_max_continuation_notes_number = args.arg_key_max_continuation_notes_number
-                                                        # Maximum number of notes of a generated continuation
-                                                        # Number of events (Note on and Note off) = number of notes * 2
-                                                        # If negative (default), without maximum/limitation.
+    _max_continuation_notes_number = args.arg_key_max_continuation_notes_number
+                                                            # Maximum number of notes of a generated continuation
+                                                            # Number of events (Note on and Note off) = number of notes * 2
+                                                            # If negative (default), without maximum/limitation.
 
-_first_continuation_default_random_generation_mode = args.arg_key_first_continuation_default_random_generation_mode
-                                                        # Random generation (among continuations) if first note generation fails
+    _first_continuation_default_random_generation_mode = args.arg_key_first_continuation_default_random_generation_mode
+                                                            # Random generation (among continuations) if first note generation fails
 
-_max_played_notes_considered = args.arg_key_max_played_notes_considered
-                                                        # Maximum last number of (most recent) played notes considered for training, an integer.
-                                                        # If negative (default), without maximum/limitation.
+    _max_played_notes_considered = args.arg_key_max_played_notes_considered
+                                                            # Maximum last number of (most recent) played notes considered for training, an integer.
+                                                            # If negative (default), without maximum/limitation.
 
-_pseudo_max_order = args.arg_key_pseudo_max_order       # Pseudo maximum Markov order (maximum sequence of notes considered) for each generation of next continuation note.
-                                                        # Default = 15
+    _pseudo_max_order = args.arg_key_pseudo_max_order       # Pseudo maximum Markov order (maximum sequence of notes considered) for each generation of next continuation note.
+                                                            # Default = 15
 
-# checking arguments
+    _generation_engine = args.arg_key_generation_engine    # Generation engine:
+                                                            # Deepest: sampling from the continuations of the deepest (longest) matching node,
+                                                            # Backoff: blending the continuations of all matching orders (PPM-like escape probabilities)
 
-_generation_mode_set = {'RealTime', 'File', 'Batch'}
+    _viewpoint_name_list = args.arg_key_viewpoints.split(',')
+                                                            # Viewpoints used for matching, in fallback order (from the most specific to the most general):
+                                                            # Pitch (main tree), Chroma, Interval, Duration (class), Velocity (band), or a combination, e.g., Pitch+Duration+Velocity
+                                                            # If no root matches for a viewpoint, the matching falls back to the next one
 
-_generation_mode_set_string = ''
-for mode_string in _generation_mode_set:
-    _generation_mode_set_string += mode_string + ', '
-_generation_mode_set_string = _generation_mode_set_string[:-2]
+    _chord_onset_threshold = args.arg_key_chord_onset_threshold
+                                                            # Notes whose onsets are within this threshold (in seconds) of the first note of a group
+                                                            # are grouped (before training and generation) into a chord token, matched by its pitch class set
+                                                            # If 0 (default), no chord tokens: chords are learnt as sequences of single notes
 
-if _generation_mode == None:
-    raise RuntimeError('Generation mode (--m) should be specified, within this set: {' + _generation_mode_set_string + '}.')
-elif _generation_mode not in _generation_mode_set:
-    raise RuntimeError('Generation mode (--m): ' + _generation_mode + ' should be an element within this set: {' + _generation_mode_set_string + '}.')
+    _root_fallback_mode = args.arg_key_root_fallback_mode  # Fallback if no root matches the last note (within all viewpoints):
+                                                            # Random: random generation (among continuations), according to --r,
+                                                            # Transpose: the context is transposed to the nearest root (within the same pitch class, otherwise the nearest pitch),
+                                                            # and the continuation is transposed back (Random fallback if this one fails too)
 
-if _key_transposition_semi_tones < 0:
-    raise RuntimeError('Transposition argument (--t): ' + str(_key_transposition_semi_tones) + ' should be a null or positive integer.')
+    _window_notes_number = args.arg_key_window_notes_number
+                                                            # Sliding window memory: the trees reflect only the last W played notes (and their transpositions)
+                                                            # As a note leaves the window, the continuations having it within their context are removed
+                                                            # from the corresponding (deepest) nodes, and emptied nodes (branches) are removed,
+                                                            # thus at most _pseudo_max_order nodes updated per note (the trees being limited to that depth)
+                                                            # If negative (default), without window: the memory grows with all notes played
 
-if _max_continuation_notes_number < 0:
-    _max_continuation_notes_number = _long
+    _path_compression_mode = args.arg_key_path_compression_mode
+                                                            # Path compressed (radix) pitch tree: a chain of nodes with single children (and the same continuations),
+                                                            # as trained from a long phrase, is a single node with a run of notes, split (lazily) when some sequence diverges
+                                                            # Fewer nodes and less pointer chasing (for training and matching), with the same continuations
 
-if _max_played_notes_considered < 0:
-    _max_played_notes_considered = _pseudo_infinite
+    _note_latency_budget = args.arg_key_note_latency_budget / 1000
+                                                            # Anytime generation: latency budget (in seconds) for the generation of each continuation note
+                                                            # The descent within the tree stops once the budget is over, the note being sampled from the deepest node reached
+                                                            # (thus a lower order), so that the timing of the output is bounded under load (generations are then no more
+                                                            # exactly reproducible, as they depend on timing)
+                                                            # If 0 (default), no budget: the descent always goes to the deepest matching node
+
+    _pitch_region_width = args.arg_key_pitch_region_width  # Pitch region (as in the original Continuator): continuations near the pitches played (the hand of the player)
+                                                            # are favoured, each one being weighted (in proportion to its occurrences) by a gaussian of its distance (in semitones)
+                                                            # to the mean pitch of the last _pitch_region_notes_number notes played, of this width (standard deviation)
+                                                            # If 0 (default), no pitch region
+
+    _recency_bias = args.arg_key_recency_bias              # Recency bias: continuations learnt recently are favoured, each one being weighted (in proportion to its occurrences)
+                                                            # by 1 + bias * 2^(-age / _recency_half_life), age being the number of continuations learnt since its last occurrence
+                                                            # If 0 (default), no bias
+
+    _sharded_memory_mode = args.arg_key_sharded_memory_mode
+                                                            # Sharded memory: the memory is saved into a directory (PostMemory.shards) with an index (continuations, and keys of the roots)
+                                                            # and a shard (file) per root (and its subtree) of each tree, and read (from PreMemory.shards) lazily:
+                                                            # only the index at start, each root being loaded at its first access (and evicted beyond _max_resident_shard_node_number nodes)
+                                                            # thus resident memory tracks the pitches actually played
+
+    _monophonic_mode = args.arg_key_monophonic_mode        # Monophonic mode (formerly continuator-mono.py): continuation notes are played one after the other
+                                                            # (each one starting when the previous one ends) instead of reconstructing overlaps from the learnt deltas
+
+    _seed = args.arg_key_seed                              # Each generation has its own random generator and seed (drawn from a generator seeded with _seed)
+                                                            # so that it may be exactly reproduced from the same memory, seed and input
+                                                            # If None (default), seeds are drawn from a generator seeded by the system
+
+    _generation_record_file_name = args.arg_key_generation_record_file_name
+                                                            # If specified, each generation is recorded (appended) into this file: memory (once per epoch), seed, input
+                                                            # and generation arguments, thus it may be replayed (Replay mode, with the same arguments) and profiled offline
+
+    _multi_player_memory_mode = args.arg_key_multi_player_memory_mode
+                                                            # Memory of the players (one per input port) in MultiPlayer mode:
+                                                            # Shared: all players train and generate from the same memory,
+                                                            # Isolated: each player has its own memory (initialized from the same PreMemory.pickle)
+
+    _stop_control_list = args.arg_key_stop_controls.split(',')
+                                                            # Stop controls of the player, stopping the Continuator: note:<pitch> (note played) or cc:<controller> (control change, e.g., a pedal, pressed)
+                                                            # Default: note:28, the lowest E of a Yamaha SP-30
+
+    # checking arguments
+
+    _generation_mode_set = {'RealTime', 'MultiPlayer', 'File', 'Batch', 'Benchmark', 'Replay'}
+
+    _generation_mode_set_string = ''
+    for mode_string in _generation_mode_set:
+        _generation_mode_set_string += mode_string + ', '
+    _generation_mode_set_string = _generation_mode_set_string[:-2]
+
+    if _generation_mode == None:
+        raise RuntimeError('Generation mode (--m) should be specified, within this set: {' + _generation_mode_set_string + '}.')
+    elif _generation_mode not in _generation_mode_set:
+        raise RuntimeError('Generation mode (--m): ' + _generation_mode + ' should be an element within this set: {' + _generation_mode_set_string + '}.')
+
+    if _generation_engine not in {'Deepest', 'Backoff'}:
+        raise RuntimeError('Generation engine (--e): ' + _generation_engine + ' should be Deepest or Backoff.')
+
+    for viewpoint_name in _viewpoint_name_list:
+        viewpoint_from_name(viewpoint_name)                 # Raises an error if some viewpoint is unknown
+        if _generation_mode == 'File' and 'Duration' in viewpoint_name.split('+'):
+            print('Warning: Viewpoint ' + viewpoint_name + ': Duration classes are in seconds, thus not meaningful for the durations (in ticks) of MIDI files (File mode).')
+
+    if _chord_onset_threshold < 0:
+        raise RuntimeError('Chord onset threshold (--c): ' + str(_chord_onset_threshold) + ' should be a null or positive number.')
+    elif _chord_onset_threshold and _monophonic_mode:
+        raise RuntimeError('Chord tokens (--c) are not supported in monophonic mode (--mono).')
+    elif _chord_onset_threshold and _viewpoint_name_list != ['Pitch']:
+        raise RuntimeError('Chord tokens (--c) are only supported with the Pitch viewpoint (--v).')
+    elif _chord_onset_threshold and _generation_mode == 'File':    # Notes read from a MIDI file have no onset times (in seconds)
+        raise RuntimeError('Chord tokens (--c) are not supported in File mode (--m).')
+
+    if _generation_mode == 'Replay' and _generation_record_file_name is None:
+        raise RuntimeError('Replay mode needs a generation record file (--g).')
+
+    if _root_fallback_mode not in {'Random', 'Transpose'}:
+        raise RuntimeError('Root fallback mode (--f): ' + _root_fallback_mode + ' should be Random or Transpose.')
+
+    if _multi_player_memory_mode not in {'Shared', 'Isolated'}:
+        raise RuntimeError('Multi player memory mode (--s): ' + _multi_player_memory_mode + ' should be Shared or Isolated.')
+
+    if _pitch_region_width < 0:
+        raise RuntimeError('Pitch region width (--region): ' + str(_pitch_region_width) + ' should be a null or positive number.')
+
+    if _recency_bias < 0:
+        raise RuntimeError('Recency bias (--bias): ' + str(_recency_bias) + ' should be a null or positive number.')
+
+    if _note_latency_budget < 0:
+        raise RuntimeError('Note latency budget (--b): ' + str(args.arg_key_note_latency_budget) + ' should be a null or positive number.')
+
+    if _key_transposition_semi_tones < 0:
+        raise RuntimeError('Transposition argument (--t): ' + str(_key_transposition_semi_tones) + ' should be a null or positive integer.')
+
+    if _max_continuation_notes_number < 0:
+        _max_continuation_notes_number = _long
+
+    if _max_played_notes_considered < 0:
+        _max_played_notes_considered = _pseudo_infinite
+
+    _stop_note_set = set()                                  # Pitches of the stop notes
+    _stop_control_set = set()                               # Controllers of the stop control changes
+    for stop_control in _stop_control_list:
+        (stop_control_type, dummy, stop_control_number) = stop_control.partition(':')
+        if stop_control_type not in {'note', 'cc'} or not stop_control_number.isdigit() or int(stop_control_number) > 127:
+            raise RuntimeError('Stop control (--stop): ' + stop_control + ' should be note:<pitch> or cc:<controller> (with a number between 0 and 127).')
+        elif stop_control_type == 'note':
+            _stop_note_set.add(int(stop_control_number))
+        else:
+            _stop_control_set.add(int(stop_control_number))
+
+    if _window_notes_number >= 0:                           # Nodes deeper than the pseudo maximum order are never matched,
+        _training_max_depth = _pseudo_max_order             # thus not needed (and not built) within a sliding window memory
+    else:
+        _training_max_depth = _pseudo_infinite
+
+    if _generation_mode == 'File':                          # Timings of MIDI files are in ticks
+        _time_base = _file_time_base
+    else:
+        _time_base = _played_time_base
 
 # hyperparameters
 _general_default_random_generation_mode = False         # Random generation (among continuations) if any note generation fails
+_match_cache_size = 4096                                # Maximum number of contexts (last pitches) within the cache of matched nodes of each generating thread,
+                                                        # 0 for no cache
+_max_resident_shard_node_number = 1000000               # Sharded memory: maximum number of nodes of the roots loaded (and not modified) of each tree,
+                                                        # beyond which the least recently loaded ones are evicted
+_pitch_region_notes_number = 8                          # Pitch region: number of last notes played whose mean pitch is the center of the region
+_recency_half_life = 500                                # Recency bias: age (number of continuations learnt, including transpositions) halving the bias
+_best_continuation_number = 5                           # Beam search: number of most probable continuations returned (best takes)
+_best_continuation_length = 16                          # Beam search: number of notes of the best continuations
+_beam_width = 32                                        # Beam search: number of hypotheses (partial continuations) kept at each step (at least the number of continuations returned)
 _generation_duration_mode = 'Learnt'                    # 3 possible modes for the durations of the continuation notes:
                                                         # Learnt: duration of the corresponding matching note learnt,
                                                         # Played: duration of the notes played
                                                         # Fixed: fixed (_default_fixed_duration) duration
 
+_played_time_base = 0.001                               # Duration (in seconds) of the unit of the timings (durations and deltas) of the continuations stored,
+                                                        # quantised as integers: 1 ms
+_file_time_base = 1                                     # Timings of MIDI files (File mode) are in ticks
+
 # constant hyperparameters (a priori not modified)
 _player_stop_continuator_start_threshold = 2.0          # Silence duration after which Continuator will start train and generate
 _player_stop_continuator_stop_threshold = 15.0          # Silence duration after which Continuator will stop
 _default_generated_note_duration = 0.5	                # Default duration for generated notes (for batch test)
 _default_generated_note_velocity = _max_midi_velocity   # Default velocity for generated notes (for batch test)
 _default_fixed_duration = 0.1                           # int in case of 'File' (Midi export) mode
+_sustain_control = 64                                   # Controller of the sustain pedal (down if value >= 64)
+_input_queue_size = 1024                                # Maximum number of messages (received and not yet processed) within the input queue of a player,
+                                                        # beyond which new notes are dropped
+
+if __name__ == '__main__':
+    configure(sys.argv[1:])
+else:                                                   # Imported as a module (e.g., by some application): default arguments, its own arguments being left alone
+    configure(['--m', 'Batch'])
 
 # classes
 class Note:                                 # Structure of a note
@@ -119,6 +305,54 @@ class Note:                                 # Structure of a note
     def match(self, note):      # Check if current note characteristics (pitch, duration and velocity) is matching some other note (only pitch)
         return note.pitch == self.pitch
 
+    def with_duration(self, duration):      # Copy with another duration (notes stored in memory are never modified)
+        return Note(pitch=self.pitch, duration=duration, velocity=self.velocity, start_time=self.start_time, delta=self.delta)
+
+    def transposed(self, t):
+        return Note(pitch=self.pitch + t, duration=self.duration, velocity=self.velocity, start_time=self.start_time, delta=self.delta)
+
+    def component_note_list(self):          # Notes to be played
+        return [self]
+
+class ChordNote(Note):                      # Chord token: notes played (nearly) simultaneously, matched by their pitch class set
+    def __init__(self, note_list):
+        pitch_class_set = 0                 # 12 bits, bit k for pitch class k
+        for note in note_list:
+            pitch_class_set |= 1 << (note.pitch % 12)
+        super().__init__(pitch=_chord_key_offset + pitch_class_set, duration=max([note.duration or 0 for note in note_list]), velocity=max([note.velocity for note in note_list]),
+                         start_time=note_list[0].start_time, delta=note_list[0].delta)
+        self.note_list = note_list
+        self.pitch_list = [note.pitch for note in note_list]
+
+    def with_duration(self, duration):
+        return ChordNote([note.with_duration(duration) for note in self.note_list])
+
+    def transposed(self, t):
+        return ChordNote([note.transposed(t) for note in self.note_list])
+
+    def component_note_list(self):
+        return self.note_list
+
+def group_chord_notes(note_sequence, onset_threshold):     # In a single linear pass, group notes whose onsets are within threshold
+                                                            # of the first note of the group into chord tokens
+    grouped_note_sequence = []
+    group_note_list = []
+    for note in note_sequence:
+        if group_note_list and note.start_time - group_note_list[0].start_time <= onset_threshold:
+            group_note_list.append(note)
+        else:
+            if group_note_list:
+                grouped_note_sequence.append(chord_token(group_note_list))
+            group_note_list = [note]
+    if group_note_list:
+        grouped_note_sequence.append(chord_token(group_note_list))
+    return grouped_note_sequence
+
+def chord_token(note_list):
+    if len(note_list) == 1:
+        return note_list[0]
+    return ChordNote(note_list)
+
 class NoteEvent(Note):
     def __init__(self, pitch, duration, velocity, delta, event_type, event_time):
         super().__init__(pitch, duration, velocity, None, delta)        # start_time is not used
@@ -141,35 +375,806 @@ def pitch_sequence_to_note_sequence(pitch_sequence):        # For Batch test
         note_sequence.append(note)
     return note_sequence
 
+def pitch_range_domain(min_pitch, max_pitch):              # Markov constraints: pitches allowed at some position, within a range
+    return set(range(min_pitch, max_pitch + 1))
+
+def pitch_class_domain(pitch_class_set, min_pitch=_min_midi_pitch, max_pitch=_max_midi_pitch):
+                                                            # Markov constraints: pitches allowed at some position, of some pitch classes (e.g., {0}: the tonic of C major)
+    return set([pitch for pitch in range(min_pitch, max_pitch + 1) if pitch % 12 in pitch_class_set])
+
+def pitch_mask(pitch_collection):                           # Domain (set of pitches) as a bit set (integer)
+    mask = 0
+    for pitch in pitch_collection:
+        mask |= 1 << pitch
+    return mask
+
+_unknown_time = -2 ** 31                    # Quantised timing (duration or delta) unknown (None)
+_key_note_dictionary = {}                   # Notes of the tree nodes, shared by pitch (only their pitch is matched)
+
+def key_note(pitch):                        # Returns the (shared) note of the tree nodes for this pitch (or chord key), thus the notes played are not kept by the trees
+    note = _key_note_dictionary.get(pitch)
+    if note is None:
+        note = Note(pitch=pitch, duration=None, velocity=None, start_time=None, delta=None)
+        _key_note_dictionary[pitch] = note
+    return note
+
+class ContinuationStore:                    # Continuations (indexed from 1, as the continuation dictionary it replaces) stored within arrays:
+                                            # pitches, velocities, and durations and deltas quantised as integers (units of time_base, _unknown_time if unknown)
+                                            # A continuation is read as a (new) note, chord tokens being kept as such
+    def __init__(self, time_base=None):
+        if time_base is None:
+            time_base = _time_base
+        self.time_base = time_base          # Duration (in seconds, or in ticks) of the unit of the timings
+        self.pitch_array = array.array('h')     # Including chord keys (and transposed pitches)
+        self.velocity_array = array.array('B')
+        self.duration_array = array.array('i')
+        self.delta_array = array.array('i')
+        self.chord_note_dictionary = {}     # key: index, value: chord token
+
+    def quantise(self, time):
+        if time is None:
+            return _unknown_time
+        return round(time / self.time_base)
+
+    def time(self, units):
+        if units == _unknown_time:
+            return None
+        return units * self.time_base
+
+    def __setitem__(self, index, note):     # Continuations are only appended
+        if index != len(self.pitch_array) + 1:
+            raise RuntimeError('Continuation ' + str(index) + ' should be stored after continuation ' + str(len(self.pitch_array)))
+        self.pitch_array.append(note.pitch)
+        self.velocity_array.append(note.velocity)
+        self.duration_array.append(self.quantise(note.duration))
+        self.delta_array.append(self.quantise(note.delta))
+        if isinstance(note, ChordNote):
+            self.chord_note_dictionary[index] = note
+
+    def __getitem__(self, index):
+        if not 1 <= index <= len(self.pitch_array):
+            raise KeyError(index)
+        if index in self.chord_note_dictionary:
+            return self.chord_note_dictionary[index]
+        k = index - 1
+        return Note(pitch=self.pitch_array[k], duration=self.time(self.duration_array[k]), velocity=self.velocity_array[k], start_time=None, delta=self.time(self.delta_array[k]))
+
+    def pitch(self, index):                 # Pitch (or chord key) of a continuation, without reading the note
+        return self.pitch_array[index - 1]
+
+    def __len__(self):
+        return len(self.pitch_array)
+
+    def __iter__(self):                     # Indexes
+        return iter(range(1, len(self.pitch_array) + 1))
+
+    def truncated(self, continuation_number):   # Copy of the first continuations (e.g., those of a snapshot)
+        continuation_store = ContinuationStore(self.time_base)
+        continuation_store.pitch_array = self.pitch_array[:continuation_number]
+        continuation_store.velocity_array = self.velocity_array[:continuation_number]
+        continuation_store.duration_array = self.duration_array[:continuation_number]
+        continuation_store.delta_array = self.delta_array[:continuation_number]
+        for (index, chord_note) in self.chord_note_dictionary.items():
+            if index <= continuation_number:
+                continuation_store.chord_note_dictionary[index] = chord_note
+        return continuation_store
+
+    def byte_number(self):
+        byte_number = sys.getsizeof(self) + sys.getsizeof(self.chord_note_dictionary)
+        for time_array in [self.pitch_array, self.velocity_array, self.duration_array, self.delta_array]:
+            byte_number += sys.getsizeof(time_array)
+        return byte_number
+
 class PrefixTreeNode:                       # Structure of a tree node to memorize and index learnt sequences
-    def __init__(self):
+    distribution = None                     # Cached distribution of continuations (class default, for memories saved before it existed)
+    key = None                              # Key of the note for some viewpoint (None within the pitch tree, which matches notes pitches)
+    epoch = 0                               # Training epoch which created (or copied) the node, the node being frozen once its epoch is published
+    note_run = ()                           # Path compression: notes of the next levels (a chain of single children with the same continuations)
+                                            # the node children being below the last one
+
+    def __init__(self, epoch=0):
         self.note = None
         self.children_list = None
         self.continuation_index_list = None
+        self.epoch = epoch
 
-class PrefixTreeContinuator:                # The main class and corresponding algorithms
+    def __getstate__(self):                 # The cached distribution and the epoch are not saved (pickle)
+        state = self.__dict__.copy()
+        state.pop('distribution', None)
+        state.pop('epoch', None)
+        return state
+
+    def writable(self, epoch):              # Copy on write: returns the node itself if created within this training epoch, otherwise a copy of it
+                                            # (the node may be read by generations from a published snapshot), at most once per epoch
+        if self.epoch == epoch:
+            return self
+        node = copy.copy(self)
+        node.epoch = epoch
+        if self.children_list is not None:
+            node.children_list = list(self.children_list)
+        node.continuation_index_list = list(self.continuation_index_list)
+        return node
+
+    def add_continuation(self, continuation_index):
+        self.continuation_index_list.append(continuation_index)
+        self.distribution = None            # Invalidate the cached distribution of continuations
+
+    def remove_continuation(self, continuation_index):     # Sliding window
+        self.continuation_index_list.remove(continuation_index)
+        self.distribution = None
+
+    def split(self, r, epoch):              # Path compression: the notes of the run from position r are moved into a new (single) child, with the same continuations
+        child_node = PrefixTreeNode(epoch)
+        child_node.note = self.note_run[r]
+        child_node.note_run = self.note_run[r + 1:]
+        child_node.key = self.key
+        child_node.continuation_index_list = list(self.continuation_index_list)
+        child_node.children_list = self.children_list
+        self.note_run = self.note_run[:r]
+        self.children_list = [child_node]
+
+    def has_continuation_distribution(self):    # If the cached distribution is up to date (thus sampling is in O(1))
+        return self.distribution is not None and self.distribution.total_count == len(self.continuation_index_list)
+
+    def continuation_distribution(self, continuation_dictionary):     # Built lazily (at first sampling after a training)
+        distribution = self.distribution
+        if distribution is None or distribution.total_count != len(self.continuation_index_list):
+            distribution = ContinuationDistribution(self.continuation_index_list, continuation_dictionary)
+            self.distribution = distribution
+        return distribution
+
+class ContinuationDistribution:             # Distribution of the distinct continuations (pitches) of a node, with an alias table (Walker/Vose)
+                                            # for sampling in O(1), regardless of the number of occurrences
+    def __init__(self, continuation_index_list, continuation_dictionary):
+        index_list_dictionary = {}          # key: pitch, value: list of the indexes of its occurrences (within continuation_dictionary)
+        for index in continuation_index_list:
+            pitch = continuation_dictionary.pitch(index)
+            if pitch in index_list_dictionary:
+                index_list_dictionary[pitch].append(index)
+            else:
+                index_list_dictionary[pitch] = [index]
+        self.pitch_list = list(index_list_dictionary)
+        self.index_list_list = list(index_list_dictionary.values())
+        self.count_list = [len(index_list) for index_list in self.index_list_list]
+        self.total_count = len(continuation_index_list)
+        self.escape_probability = len(self.count_list) / (self.total_count + len(self.count_list))
+                                            # PPM (method C) escape probability: number of distinct continuations / (number of occurrences + number of distinct continuations)
+        self.build_alias_table()
+        self.log_probability_list = None    # Built lazily (beam search)
+        self.latest_index_list = None       # Built lazily (recency bias)
+
+    def log_probabilities(self):            # Returns the log probabilities of the distinct continuations
+        if self.log_probability_list is None:
+            log_total_count = math.log(self.total_count)
+            self.log_probability_list = [math.log(count) - log_total_count for count in self.count_list]
+        return self.log_probability_list
+
+    def latest_indexes(self):               # Returns the index of the last (most recent) occurrence of each distinct continuation
+        if self.latest_index_list is None:
+            self.latest_index_list = [index_list[-1] for index_list in self.index_list_list]
+        return self.latest_index_list
+
+    def build_alias_table(self):            # Vose alias method
+        distinct_number = len(self.count_list)
+        scaled_probability_list = [count * distinct_number / self.total_count for count in self.count_list]
+        self.probability_list = [1.] * distinct_number
+        self.alias_list = list(range(distinct_number))
+        small_list = []
+        large_list = []
+        for k in range(distinct_number):
+            if scaled_probability_list[k] < 1.:
+                small_list.append(k)
+            else:
+                large_list.append(k)
+        while small_list and large_list:
+            small = small_list.pop()
+            large = large_list.pop()
+            self.probability_list[small] = scaled_probability_list[small]
+            self.alias_list[small] = large
+            scaled_probability_list[large] = scaled_probability_list[large] + scaled_probability_list[small] - 1.
+            if scaled_probability_list[large] < 1.:
+                small_list.append(large)
+            else:
+                large_list.append(large)
+                                            # Remaining ones (large or, because of rounding, small) keep probability 1
+
+    def sample_distinct(self, rng):         # Returns the position of a distinct continuation, with a probability proportional to its number of occurrences
+        k = int(rng.random() * len(self.probability_list))
+        if rng.random() < self.probability_list[k]:
+            return k
+        else:
+            return self.alias_list[k]
+
+    def sample(self, rng):                  # Returns the index (within continuation_dictionary) of one occurrence of a sampled continuation
+        index_list = self.index_list_list[self.sample_distinct(rng)]
+        return index_list[int(rng.random() * len(index_list))]
+
+class ContinuationSteering:                 # Pitch region and recency bias of a generation: weights of the distinct continuations of a node (in proportion to
+                                            # their occurrences) computed at sampling time from the (cached) distribution of the node, without copying its lists
+    def __init__(self, note_sequence, continuation_number):
+        self.continuation_number = continuation_number
+        self.region_weight_list = None      # Weight of each pitch (gaussian around the mean pitch played), None if no pitch region
+        if _pitch_region_width:
+            pitch_list = []
+            for note in note_sequence[-_pitch_region_notes_number:]:
+                for component_note in note.component_note_list():
+                    pitch_list.append(component_note.pitch)
+            center = sum(pitch_list) / len(pitch_list)
+            self.region_weight_list = [math.exp(-0.5 * ((pitch - center) / _pitch_region_width) ** 2) for pitch in range(_max_midi_pitch + 1)]
+
+    def sample(self, distribution, rng):    # Returns the index (within continuation_dictionary) of one occurrence of a continuation sampled with the steered weights
+        count_list = distribution.count_list
+        pitch_list = distribution.pitch_list
+        if _recency_bias:
+            latest_index_list = distribution.latest_indexes()
+        cumulative_weight_list = []
+        total_weight = 0.
+        for k in range(len(count_list)):
+            weight = count_list[k]
+            if self.region_weight_list is not None and pitch_list[k] <= _max_midi_pitch:    # (Chord tokens are not weighted by region)
+                weight *= self.region_weight_list[pitch_list[k]]
+            if _recency_bias:
+                weight *= 1. + _recency_bias * 0.5 ** ((self.continuation_number - latest_index_list[k]) / _recency_half_life)
+            total_weight += weight
+            cumulative_weight_list.append(total_weight)
+        if total_weight <= 0.:              # All continuations far outside the region: not steered
+            return distribution.sample(rng)
+        k = min(bisect.bisect(cumulative_weight_list, rng.random() * total_weight), len(count_list) - 1)
+        index_list = distribution.index_list_list[k]
+        return index_list[int(rng.random() * len(index_list))]
+
+class ViewpointTree:                        # Prefix trees indexing learnt sequences by the (integer) keys of a viewpoint
+                                            # Nodes refer to the same continuations (indexes within continuation_dictionary) as the pitch tree
+    def __init__(self, viewpoint):
+        self.viewpoint = viewpoint
+        self.root_dictionary = {}
+
+    def train(self, note_sequence, first_continuation_index, epoch):  # Same as internal_train_without_key_transpose, but with keys
+        reversed_note_sequence = note_sequence[::-1]
+        reversed_key_sequence = self.viewpoint.encode_sequence(note_sequence)[::-1]
+        for i in range(len(reversed_key_sequence) - 1):
+            continuation_index = first_continuation_index + i
+            root_key = reversed_key_sequence[i + 1]
+            if root_key not in self.root_dictionary:
+                current_node = PrefixTreeNode(epoch)
+                current_node.note = key_note(reversed_note_sequence[i + 1].pitch)
+                current_node.key = root_key
+                current_node.continuation_index_list = [continuation_index]
+                self.root_dictionary[root_key] = current_node
+            else:
+                current_node = self.root_dictionary[root_key].writable(epoch)
+                self.root_dictionary[root_key] = current_node
+                current_node.add_continuation(continuation_index)
+            for j in range(i + 2, min(len(reversed_key_sequence), i + 1 + _training_max_depth)):
+                key = reversed_key_sequence[j]
+                matching_child = None
+                if current_node.children_list is None:
+                    current_node.children_list = []
+                else:
+                    for k in range(len(current_node.children_list)):
+                        if current_node.children_list[k].key == key:
+                            matching_child = current_node.children_list[k].writable(epoch)
+                            current_node.children_list[k] = matching_child
+                            break
+                if matching_child is None:
+                    matching_child = PrefixTreeNode(epoch)
+                    matching_child.note = key_note(reversed_note_sequence[j].pitch)
+                    matching_child.key = key
+                    matching_child.continuation_index_list = [continuation_index]
+                    current_node.children_list.append(matching_child)
+                else:
+                    matching_child.add_continuation(continuation_index)
+                current_node = matching_child
+
+    def remove_continuation(self, context_key_list, continuation_index, epoch):   # Same as PrefixTreeContinuator.remove_continuation, but with keys
+        if context_key_list[0] not in self.root_dictionary:
+            return
+        current_node = self.root_dictionary[context_key_list[0]].writable(epoch)
+        self.root_dictionary[context_key_list[0]] = current_node
+        parent_node = None
+        k = None
+        for key in context_key_list[1:]:
+            if current_node.children_list is None:
+                return
+            for k in range(len(current_node.children_list)):
+                if current_node.children_list[k].key == key:
+                    break
+            else:
+                return
+            parent_node = current_node
+            current_node = current_node.children_list[k].writable(epoch)
+            parent_node.children_list[k] = current_node
+        if continuation_index in current_node.continuation_index_list:
+            current_node.remove_continuation(continuation_index)
+            if not current_node.continuation_index_list:
+                if parent_node is None:
+                    del self.root_dictionary[context_key_list[0]]
+                else:
+                    del parent_node.children_list[k]
+
+    def match(self, key_sequence, length_key_sequence, root_dictionary, deadline=None):     # Same as PrefixTreeContinuator.match_pitch, but with keys
+        if key_sequence[-1] not in root_dictionary:
+            return []
+        current_node = root_dictionary[key_sequence[-1]]
+        matched_node_list = [current_node]
+        j = 2
+        while current_node.children_list is not None and j < length_key_sequence and j <= _pseudo_max_order:
+            if deadline is not None and deadline.is_over():
+                deadline.is_truncated = True
+                break
+            key = key_sequence[-j]
+            matching_child = None
+            for child in current_node.children_list:
+                if child.key == key:
+                    matching_child = child
+                    break
+            if matching_child is None:
+                break
+            current_node = matching_child
+            matched_node_list.append(current_node)
+            j += 1
+        return matched_node_list
+
+class MemorySnapshot:                       # Frozen version (epoch) of the memory, read by generations while training builds the next one
+    def __init__(self, epoch, root_dictionary, viewpoint_root_dictionary_list, continuation_number, root_pitch_list, continuation_range_list=None):
+        self.epoch = epoch
+        self.root_dictionary = root_dictionary
+        self.viewpoint_root_dictionary_list = viewpoint_root_dictionary_list    # Parallel to viewpoint_tree_list (None for the pitch tree)
+        self.continuation_number = continuation_number      # Continuations 1 to continuation_number (continuation_dictionary is shared, as it only grows)
+        self.continuation_range_list = continuation_range_list  # Sliding window: ranges (first, last) of the indexes of the continuations within the window,
+                                                                # None if all continuations are within the memory
+        self.root_pitch_list = root_pitch_list              # Sorted pitches of the roots (chord tokens excepted), for the Transpose fallback
+        self.successor_mask_dictionary = None               # Markov constraints: key: pitch of a root, value: bit set of the pitches of its continuations (order 1)
+                                                            # built lazily (at the first constrained generation)
+
+    def continuation_indexes(self):         # Indexes of the continuations within the memory (window)
+        if self.continuation_range_list is None:
+            return range(1, self.continuation_number + 1)
+        return [index for (first_index, last_index) in self.continuation_range_list for index in range(first_index, last_index + 1)]
+
+    def random_continuation_index(self, rng):   # Order 0: index of a continuation drawn uniformly among the ones within the memory (window)
+        if self.continuation_range_list is None:
+            return rng.randint(1, self.continuation_number)
+        k = rng.randint(0, sum([last_index - first_index + 1 for (first_index, last_index) in self.continuation_range_list]) - 1)
+        for (first_index, last_index) in self.continuation_range_list:
+            if k <= last_index - first_index:
+                return first_index + k
+            k -= last_index - first_index + 1
+
+    def nearest_root_pitch(self, pitch):    # Returns the nearest root pitch within the same pitch class (octaves), otherwise the nearest one, or None
+        if not self.root_pitch_list or pitch >= _chord_key_offset:
+            return None
+        for octave in range(12, _max_midi_pitch + 1, 12):
+            if pitch - octave in self.root_dictionary:
+                return pitch - octave
+            if pitch + octave in self.root_dictionary:
+                return pitch + octave
+        k = bisect.bisect_left(self.root_pitch_list, pitch)   # In O(log n)
+        if k == len(self.root_pitch_list):
+            return self.root_pitch_list[-1]
+        elif k == 0 or self.root_pitch_list[k] - pitch < pitch - self.root_pitch_list[k - 1]:
+            return self.root_pitch_list[k]
+        else:
+            return self.root_pitch_list[k - 1]
+
+class MatchCacheCounter:                    # Hits and misses of a cache of matched nodes, kept (merged) once its thread has ended
     def __init__(self):
+        self.hits_number = 0
+        self.misses_number = 0
+
+class MatchCache:                           # Bounded (least recently used) cache of the nodes matched within the pitch tree, keyed by the last pitches
+                                            # One per generating thread (session), thus no lock, and invalidated by a new snapshot (training)
+    def __init__(self, size):
+        self.size = size
+        self.node_list_dictionary = collections.OrderedDict()   # key: last pitches (tuple), value: matched nodes list
+        self.root_dictionary = None         # Roots dictionary of the snapshot of the cached nodes
+        self.counter = MatchCacheCounter()
+
+    def get(self, context, root_dictionary):    # Returns the cached matched nodes list, or None
+        if root_dictionary is not self.root_dictionary:
+            self.node_list_dictionary.clear()
+            self.root_dictionary = root_dictionary
+        matched_node_list = self.node_list_dictionary.get(context)
+        if matched_node_list is None:
+            self.counter.misses_number += 1
+        else:
+            self.node_list_dictionary.move_to_end(context)
+            self.counter.hits_number += 1
+        return matched_node_list
+
+    def invalidate(self):                   # Releases the nodes (and roots dictionary) of an old snapshot, called by the training thread
+                                            # Attributes are rebound (atomically), thus without lock with the thread of the cache
+        self.root_dictionary = None
+        self.node_list_dictionary = collections.OrderedDict()
+
+    def put(self, context, matched_node_list):
+        self.node_list_dictionary[context] = matched_node_list
+        if len(self.node_list_dictionary) > self.size:
+            self.node_list_dictionary.popitem(last=False)
+
+class MatchCacheRegistry:                   # Caches of matched nodes of the threads generating from a memory, and their counters
+                                            # Kept apart from the memory, thus a cache (until its thread ends) does not keep the memory alive
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.match_cache_set = weakref.WeakSet()        # Caches of the live threads (a cache is released when its thread ends)
+        self.counter_set = set()                        # Counters of the caches of the live threads
+        self.retired_counter = MatchCacheCounter()      # Merged counters of the caches of the ended threads
+
+    def register(self, match_cache):
+        with self.lock:
+            self.match_cache_set.add(match_cache)
+            self.counter_set.add(match_cache.counter)
+        weakref.finalize(match_cache, self.retire, match_cache.counter)    # When its thread ends
+
+    def retire(self, counter):
+        with self.lock:
+            self.counter_set.discard(counter)
+            self.retired_counter.hits_number += counter.hits_number
+            self.retired_counter.misses_number += counter.misses_number
+
+    def invalidate(self):                   # A new snapshot has been published: the caches release the nodes of the previous one
+        with self.lock:
+            match_cache_list = list(self.match_cache_set)
+        for match_cache in match_cache_list:
+            match_cache.invalidate()
+
+    def statistics(self):                   # Returns number of hits and of misses, of all threads
+        with self.lock:
+            hits_number = self.retired_counter.hits_number
+            misses_number = self.retired_counter.misses_number
+            for counter in self.counter_set:
+                hits_number += counter.hits_number
+                misses_number += counter.misses_number
+        return hits_number, misses_number
+
+class NoteDeadline:                         # Anytime generation: deadline of the generation of a note (from its latency budget)
+    def __init__(self, budget):
+        self.deadline_time = time.perf_counter() + budget
+        self.is_truncated = False           # If some descent within a tree has been stopped by the deadline (before its deepest matching node)
+
+    def is_over(self):
+        return time.perf_counter() > self.deadline_time
+
+class MemoryShardStore:                     # Directory of a sharded memory: an index (Index.pickle) and a shard (file) per root of each tree
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()        # Shards are loaded (and evicted) by training as well as generating threads
+
+    def shard_file_name(self, tree_name, key):
+        return os.path.join(self.directory, tree_name + '_' + str(key) + '.pickle')
+
+    def index_file_name(self):
+        return os.path.join(self.directory, 'Index.pickle')
+
+    def load_shard(self, tree_name, key):
+        with open(self.shard_file_name(tree_name, key), 'rb') as shard_file:
+            return pickle.load(shard_file)
+
+class ShardedRootDictionary(dict):          # Roots dictionary of a tree of a sharded memory: each root (and its subtree) is loaded from its shard at its first access,
+                                            # the least recently loaded ones being evicted beyond _max_resident_shard_node_number nodes (and loaded again if needed)
+                                            # A root modified by training (thus no more the one of its shard) is kept as within a usual dictionary
+    def __init__(self, shard_store, tree_name, shard_key_dictionary):
+        super().__init__()
+        self.shard_store = shard_store
+        self.tree_name = tree_name
+        self.shard_key_dictionary = shard_key_dictionary    # key: key of a root within its shard (not modified), value: number of nodes of the shard
+        self.resident_key_dictionary = collections.OrderedDict()   # Keys of the roots loaded (and not modified), least recently loaded first
+        self.resident_node_number = 0
+
+    def __missing__(self, key):             # Fault in the root from its shard
+        with self.shard_store.lock:
+            if dict.__contains__(self, key):                # Loaded meanwhile by another thread
+                return dict.__getitem__(self, key)
+            if key not in self.shard_key_dictionary:
+                raise KeyError(key)
+            root = self.shard_store.load_shard(self.tree_name, key)
+            dict.__setitem__(self, key, root)
+            self.resident_key_dictionary[key] = True
+            self.resident_node_number += self.shard_key_dictionary[key]
+            while self.resident_node_number > _max_resident_shard_node_number and len(self.resident_key_dictionary) > 1:
+                (evicted_key, dummy) = self.resident_key_dictionary.popitem(last=False)
+                dict.__delitem__(self, evicted_key)
+                self.resident_node_number -= self.shard_key_dictionary[evicted_key]
+            return root
+
+    def release_shard(self, key):           # The root is no more the one of its shard (the lock being held)
+        if key in self.resident_key_dictionary:
+            del self.resident_key_dictionary[key]
+            self.resident_node_number -= self.shard_key_dictionary[key]
+        del self.shard_key_dictionary[key]
+
+    def __setitem__(self, key, root):
+        if key in self.shard_key_dictionary:
+            with self.shard_store.lock:
+                self.release_shard(key)
+        dict.__setitem__(self, key, root)
+
+    def __delitem__(self, key):
+        if key in self.shard_key_dictionary:
+            with self.shard_store.lock:
+                is_resident = dict.__contains__(self, key)
+                self.release_shard(key)
+                if is_resident:
+                    dict.__delitem__(self, key)
+        else:
+            dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.shard_key_dictionary
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):                         # Keys of all roots (loaded or not)
+        with self.shard_store.lock:
+            return list(dict.keys(self)) + [key for key in self.shard_key_dictionary if not dict.__contains__(self, key)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):                       # All roots (loading the ones not loaded)
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def copy(self):                         # Copy (new training epoch), sharing the roots loaded
+        with self.shard_store.lock:
+            root_dictionary = ShardedRootDictionary(self.shard_store, self.tree_name, dict(self.shard_key_dictionary))
+            root_dictionary.resident_key_dictionary = collections.OrderedDict(self.resident_key_dictionary)
+            root_dictionary.resident_node_number = self.resident_node_number
+            dict.update(root_dictionary, dict.items(self))
+        return root_dictionary
+
+    def resident_dictionary(self):          # Roots loaded (or modified), as a usual dictionary
+        with self.shard_store.lock:
+            return dict(dict.items(self))
+
+    def shard_statistics(self):             # Returns numbers of shards loaded, and of shards (roots not modified)
+        with self.shard_store.lock:
+            return len(self.resident_key_dictionary), len(self.shard_key_dictionary)
+
+    def __reduce__(self):                   # Saved (pickle) as a usual dictionary
+        return dict, (dict(self.items()),)
+
+def generation_parameter_dictionary():     # Arguments the generations depend on (besides memory, seed and input), recorded with each generation
+    return {'--n': _max_continuation_notes_number, '--r': _first_continuation_default_random_generation_mode, '--o': _pseudo_max_order,
+            '--e': _generation_engine, '--v': ','.join(_viewpoint_name_list), '--c': _chord_onset_threshold, '--f': _root_fallback_mode,
+            '--w': _window_notes_number, '--radix': _path_compression_mode, '--b': _note_latency_budget * 1000,
+            '--region': _pitch_region_width, '--bias': _recency_bias}
+
+class GenerationRecorder:                   # Records the generations into a file (appended) within a writer thread, thus off the generation path
+                                            # The memory (snapshot) of each epoch is recorded once, [Memory, memory number, epoch, memory], before the generations
+                                            # referring to it, [Generation, memory number, seed, input, parameters], and writes are serialized by the writer thread
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.queue = queue.Queue()
+        self.memory_number_dictionary = weakref.WeakKeyDictionary()    # key: snapshot, value: memory number (or None if it could not be recorded)
+        self.next_memory_number = 0
+        self.thread = threading.Thread(target=self.write_records, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)         # Pending records are written before exiting
+
+    def record(self, continuator, snapshot, seed, note_sequence):
+        self.queue.put((continuator, snapshot, seed, note_sequence, generation_parameter_dictionary()))
+
+    def write_records(self):
+        with open(self.file_name, 'ab') as generation_record_file:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                (continuator, snapshot, seed, note_sequence, parameter_dictionary) = record
+                if snapshot not in self.memory_number_dictionary:
+                    memory_number = self.next_memory_number
+                    self.next_memory_number += 1
+                    try:
+                        generation_record_file.write(pickle.dumps(['Memory', memory_number, snapshot.epoch, continuator.snapshot_memory(snapshot)]))
+                    except RecursionError:
+                        print('Warning: Memory (epoch ' + str(snapshot.epoch) + ') is too deep to be recorded, its generations will not be recorded.')
+                        memory_number = None
+                    self.memory_number_dictionary[snapshot] = memory_number
+                memory_number = self.memory_number_dictionary[snapshot]
+                if memory_number is not None:
+                    pickle.dump(['Generation', memory_number, seed, note_sequence, parameter_dictionary], generation_record_file)
+                if self.queue.empty():
+                    generation_record_file.flush()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+_generation_recorder = None                 # Shared by all the memories (e.g., of isolated players), thus a single writer of the file
+_generation_recorder_lock = threading.Lock()
+
+def generation_recorder():
+    global _generation_recorder
+    with _generation_recorder_lock:
+        if _generation_recorder is None:
+            _generation_recorder = GenerationRecorder(_generation_record_file_name)
+        return _generation_recorder
+
+class PrefixTreeContinuator:                # The main class and corresponding algorithms
+    def __init__(self, monophonic=None, path_compression=None):    # By default, according to the arguments (--mono, --radix)
+        if monophonic is None:
+            monophonic = _monophonic_mode
+        if path_compression is None:
+            path_compression = _path_compression_mode
+        self.monophonic = monophonic        # Monophonic or polyphonic mode, both with the same memory and algorithms (only the scheduling of continuation notes differs)
+        self.path_compression = path_compression    # Path compressed (radix) pitch tree: chains of single children are trained as a single node with a run of notes
         self.root_dictionary = {}
-        self.continuation_dictionary = {}
+        self.continuation_dictionary = ContinuationStore()      # Continuations (with quantised timings), indexed from 1
         self.continuation_dictionary_current_index = 1
+        self.viewpoint_tree_list = []       # Viewpoints trees, in fallback order (None for the pitch tree: root_dictionary)
+        for viewpoint_name in _viewpoint_name_list:
+            if viewpoint_name == 'Pitch':
+                self.viewpoint_tree_list.append(None)
+            else:
+                self.viewpoint_tree_list.append(ViewpointTree(viewpoint_from_name(viewpoint_name)))
         self.continuation_sequence = []
+        self.seed_generator = random.Random(_seed)      # Draws the seeds of the generations (when not specified)
+        self.training_lock = threading.Lock()   # Serializes training when several players (sessions) share this memory
+                                                # Generation does not take it: it reads the last published snapshot
+        self.epoch = 0                          # Current training epoch (one per training)
+        self.window_phrase_deque = collections.deque()  # Sliding window: phrases trained, oldest first, each one as [list of (first continuation index, note sequence)
+                                                        # for the sequence and its transpositions, number of notes already removed (out of the window)]
+        self.window_notes_number = 0                    # Number of played notes within the window
+        self.read_continuation_number = 0               # Number of continuations of the memory read (not within the window, thus kept)
+        self.read_continuation_range_list = None        # Ranges of the indexes of the continuations within the memory read (if read from a window), None if all
+        self.root_pitch_list = []                       # Sorted pitches of the roots of the pitch tree (chord tokens excepted), updated by training
+        self.match_cache_local = threading.local()      # Cache of matched nodes of the current thread
+        self.match_cache_registry = MatchCacheRegistry()    # Caches of all threads (for invalidation and statistics)
+        self.budget_statistics_lock = threading.Lock()  # Anytime generation statistics (of all threads)
+        self.budget_note_number = 0                     # Number of notes generated within a latency budget
+        self.budget_truncated_note_number = 0           # Number of them whose match has been truncated by the budget
+        self.budget_direct_sample_note_number = 0       # Number of them sampled directly (without building the distribution of the node) once over budget
+        self.publish_snapshot()
+
+    def publish_snapshot(self):             # The trees being trained become the snapshot read by generations (atomic assignment)
+                                            # The next training will copy (on write) the nodes it modifies, thus the snapshot stays frozen
+        viewpoint_root_dictionary_list = []
+        for viewpoint_tree in self.viewpoint_tree_list:
+            if viewpoint_tree is None:
+                viewpoint_root_dictionary_list.append(None)
+            else:
+                viewpoint_root_dictionary_list.append(viewpoint_tree.root_dictionary)
+        self.snapshot = MemorySnapshot(self.epoch, self.root_dictionary, viewpoint_root_dictionary_list, self.continuation_dictionary_current_index - 1,
+                                       list(self.root_pitch_list), self.continuation_range_list())
+        self.match_cache_registry.invalidate()
+
+    def continuation_range_list(self):      # Sliding window: ranges (first, last) of the indexes of the continuations still within the window, None if all
+                                            # Continuations of note q of a phrase (indexed from its last note) leave the window with note q - 1
+        if _window_notes_number < 0 and self.read_continuation_range_list is None:
+            return None
+        if self.read_continuation_range_list is None:
+            range_list = [(1, self.read_continuation_number)]
+        else:
+            range_list = list(self.read_continuation_range_list)
+        if self.window_phrase_deque:
+            (trained_sequence_list, removed_notes_number) = self.window_phrase_deque[0]     # Oldest phrase, partly out of the window
+            for (first_continuation_index, note_sequence) in trained_sequence_list:
+                range_list.append((first_continuation_index, first_continuation_index + len(note_sequence) - 2 - removed_notes_number))
+            (first_continuation_index, note_sequence) = trained_sequence_list[-1]
+            range_list.append((first_continuation_index + len(note_sequence) - 1, self.continuation_dictionary_current_index - 1))
+        return [(first_index, last_index) for (first_index, last_index) in range_list if first_index <= last_index]
+
+    def begin_epoch(self):                  # New training epoch, with its own (copied) roots dictionaries
+        self.epoch += 1
+        self.root_dictionary = self.root_dictionary.copy()
+        for viewpoint_tree in self.viewpoint_tree_list:
+            if viewpoint_tree is not None:
+                viewpoint_tree.root_dictionary = viewpoint_tree.root_dictionary.copy()
 
     def train(self, note_sequence):         # Main entry function lo train the Continuator with a sequence of notes
                                             # note_sequence = [(<pitch_1>, <duration_1>, <velocity_#), ... , (<pitch_N>, <duration_N>, <velocity_N>)]
+        if _chord_onset_threshold:
+            note_sequence = group_chord_notes(note_sequence, _chord_onset_threshold)
         self.compute_delta(note_sequence)
-        self.internal_train_without_key_transpose(note_sequence)    # Train with input sequence
-        if _key_transposition_semi_tones:
-            note_pitch_sequence = note_sequence_to_pitch_sequence(note_sequence)
-            down_iterations_number = min(min(note_pitch_sequence) - _min_midi_pitch, _key_transposition_semi_tones - 1)
-            up_iterations_number = min(_max_midi_pitch - max(note_pitch_sequence), _key_transposition_semi_tones)
-            i = 1
-            while i <= down_iterations_number:
-                self.internal_train_without_key_transpose(self.transpose(note_sequence, -i))
-                i += 1
-            i = 1
-            while i <= up_iterations_number:
-                self.internal_train_without_key_transpose(self.transpose(note_sequence, i))
-                i += 1
+        with self.training_lock:
+            self.begin_epoch()
+            trained_sequence_list = [(self.continuation_dictionary_current_index, note_sequence)]
+            self.internal_train_without_key_transpose(note_sequence)    # Train with input sequence
+            if _key_transposition_semi_tones:
+                note_pitch_sequence = []
+                for note in note_sequence:
+                    for component_note in note.component_note_list():
+                        note_pitch_sequence.append(component_note.pitch)
+                down_iterations_number = min(min(note_pitch_sequence) - _min_midi_pitch, _key_transposition_semi_tones - 1)
+                up_iterations_number = min(_max_midi_pitch - max(note_pitch_sequence), _key_transposition_semi_tones)
+                i = 1
+                while i <= down_iterations_number:
+                    trained_sequence_list.append((self.continuation_dictionary_current_index, self.transpose(note_sequence, -i)))
+                    self.internal_train_without_key_transpose(trained_sequence_list[-1][1])
+                    i += 1
+                i = 1
+                while i <= up_iterations_number:
+                    trained_sequence_list.append((self.continuation_dictionary_current_index, self.transpose(note_sequence, i)))
+                    self.internal_train_without_key_transpose(trained_sequence_list[-1][1])
+                    i += 1
+            if _window_notes_number >= 0:
+                self.window_phrase_deque.append([trained_sequence_list, 0])
+                self.window_notes_number += len(note_sequence)
+                self.slide_window()
+            self.publish_snapshot()
+
+    def slide_window(self):                 # Remove the oldest notes (and their transpositions) until the window holds at most _window_notes_number notes
+        while self.window_notes_number > _window_notes_number:
+            phrase = self.window_phrase_deque[0]
+            for (first_continuation_index, note_sequence) in phrase[0]:
+                self.remove_note(first_continuation_index, note_sequence, phrase[1])
+            phrase[1] += 1
+            self.window_notes_number -= 1
+            if phrase[1] == len(phrase[0][0][1]):       # All notes of the phrase are out of the window
+                self.window_phrase_deque.popleft()
+
+    def remove_note(self, first_continuation_index, note_sequence, m):
+                                            # Note m (the oldest one within the window, thus notes before it have already been removed) leaves
+                                            # the context of the continuations of the next notes q (at most _training_max_depth ones) of the sequence:
+                                            # each continuation is removed from the node of depth q - m (matching note m), the deepest one left for it
+        last_q = min(m + _training_max_depth, len(note_sequence) - 1)
+        viewpoint_key_sequence_list = []
+        for viewpoint_tree in self.viewpoint_tree_list:
+            if viewpoint_tree is not None:
+                key_sequence = []
+                for q in range(m, last_q):
+                    key_sequence.append(viewpoint_tree.viewpoint.encode(note_sequence[q], note_sequence[q - 1] if q > 0 else None))
+                viewpoint_key_sequence_list.append((viewpoint_tree, key_sequence))
+        for q in range(m + 1, last_q + 1):
+            continuation_index = first_continuation_index + len(note_sequence) - 1 - q     # Continuations are indexed from the last note of the sequence
+            self.remove_continuation(note_sequence[q - 1:m - 1 if m > 0 else None:-1], continuation_index)
+            for (viewpoint_tree, key_sequence) in viewpoint_key_sequence_list:
+                viewpoint_tree.remove_continuation(key_sequence[q - 1 - m::-1], continuation_index, self.epoch)
+
+    def remove_continuation(self, context_note_list, continuation_index):
+                                            # Remove a continuation from the node matching its context (from the root note), and this node
+                                            # (and thus its branch, as the continuations of a node include the ones of its children) if left empty
+        root_pitch = context_note_list[0].pitch
+        if root_pitch not in self.root_dictionary:
+            return
+        current_node = self.root_dictionary[root_pitch].writable(self.epoch)   # Copy on write, as for training
+        self.root_dictionary[root_pitch] = current_node
+        parent_node = None
+        k = None
+        r = 0                               # Path compression: position (level) of the last note matched, within the current node (0 for its note)
+        for note in context_note_list[1:]:
+            if r < len(current_node.note_run):
+                if not current_node.note_run[r].match(note):
+                    return
+                r += 1
+                continue
+            if current_node.children_list is None:
+                return
+            for k in range(len(current_node.children_list)):
+                if current_node.children_list[k].note.match(note):
+                    break
+            else:
+                return
+            parent_node = current_node
+            current_node = current_node.children_list[k].writable(self.epoch)
+            parent_node.children_list[k] = current_node
+            r = 0
+        if r < len(current_node.note_run):  # Path compression: the node is split so that the level of the continuation is a node of its own
+            current_node.split(r, self.epoch)
+        if r > 0:
+            current_node.split(r - 1, self.epoch)
+            parent_node = current_node
+            k = 0
+            current_node = current_node.children_list[0]
+        if continuation_index in current_node.continuation_index_list:
+            current_node.remove_continuation(continuation_index)
+            if not current_node.continuation_index_list:
+                if parent_node is None:
+                    del self.root_dictionary[root_pitch]
+                    if root_pitch < _chord_key_offset:
+                        self.root_pitch_list.remove(root_pitch)
+                else:
+                    del parent_node.children_list[k]
 
     @staticmethod
     def compute_delta(note_sequence):
@@ -180,13 +1185,15 @@ class PrefixTreeContinuator:                # The main class and corresponding a
     def transpose(note_sequence, t):
         transposed_note_sequence = []
         for note in note_sequence:
-            new_note = Note(pitch=note.pitch + t, duration=note.duration, velocity=note.velocity, start_time=note.start_time, delta=note.delta)
-            transposed_note_sequence.append(new_note)
+            transposed_note_sequence.append(note.transposed(t))
         return transposed_note_sequence
 
     def internal_train_without_key_transpose(self, note_sequence):  # Main internal train function
         if not self.root_dictionary and len(note_sequence) <= 1:
             raise RuntimeError('Only one note initially played, thus none continuation can be learnt and therefore generated')
+        for viewpoint_tree in self.viewpoint_tree_list:             # Viewpoints trees share the continuations indexes of the pitch tree
+            if viewpoint_tree is not None:
+                viewpoint_tree.train(note_sequence, self.continuation_dictionary_current_index, self.epoch)
         reversed_note_sequence = note_sequence[::-1]                # [note_N, ... , note_1]
         i = 0                                                       # index of the first item of the reversed played note sequence
         while i < len(reversed_note_sequence) - 1:                  # i will vary from 0 (note_N) to length-1 (note_1)
@@ -194,162 +1201,627 @@ class PrefixTreeContinuator:                # The main class and corresponding a
             continuation_note = sub_reversed_note_sequence[0]       # Continuation_note = note_i
             self.continuation_dictionary[self.continuation_dictionary_current_index] = continuation_note    # Add it to the continuation dictionary
             root_note = sub_reversed_note_sequence[1]               # Second note of the sub sequence is the note to be searched/matched as a root of a tree
+            depth_limit = min(len(sub_reversed_note_sequence), _training_max_depth + 1)     # Notes of the context: sub_reversed_note_sequence[1:depth_limit]
             if root_note.pitch not in self.root_dictionary:         # If the note has not yet some corresponding prefix tree root,
-                current_node = PrefixTreeNode()                     # then, creation of the corresponding new tree (root)
+                self.root_dictionary[root_note.pitch] = self.new_branch(sub_reversed_note_sequence[1:depth_limit], self.continuation_dictionary_current_index)
+                                                                    # then, creation of the corresponding new tree (root, and its branch)
+                if root_note.pitch < _chord_key_offset:
+                    bisect.insort(self.root_pitch_list, root_note.pitch)
+            else:                                                   # otherwise, iterative traversal of the tree branches
+                current_node = self.root_dictionary[root_note.pitch].writable(self.epoch)      # Copy on write, if the root is within the snapshot
                 self.root_dictionary[root_note.pitch] = current_node
-                current_node.note = root_note
-                current_node.continuation_index_list = [self.continuation_dictionary_current_index]
-            else:                                                   # otherwise, recursive traversal of the tree branches
-                current_node = self.root_dictionary[root_note.pitch]
-                current_node.continuation_index_list.append(self.continuation_dictionary_current_index) # At first, add the continuation to the continuation list of the root
-            for j in range(2, len(sub_reversed_note_sequence), 1):  # Iterative traversal for matching jth level node of the sub reverse input sequence
+                j = 2                                               # Index of the next note (of the sub reverse input sequence) to be matched
+                while True:                                         # Iterative traversal for matching jth level node of the sub reverse input sequence
                                                                     # with a note of the corresponding jth tree branch level children
-                                                                    # j will vary from 0 (note_i-2) to i - 2 (note_1),
                                                                     # with note_i : continuation and note_i-1 = root node
-                note = sub_reversed_note_sequence[j]
-                if current_node.children_list is None:              # If there is no children, then, we have met a terminating leaf,
-                    new_child_node = PrefixTreeNode()               # then, we create and insert a new node
-                    new_child_node.note = note
-                    new_child_node.continuation_index_list = [self.continuation_dictionary_current_index]
-                    current_node.children_list = [new_child_node]
-                    current_node = new_child_node                   # and continue the iterated traversal
-                else:                                               # otherwise,
-                    node_exists = False                             # we set up the initial value of a flag to know if we have found a matching node
-                    for child_node in current_node.children_list:   # while iterating over the children
-                        if child_node.note.match(note):             # This child (exactly) matches
-                            child_node.continuation_index_list.append(self.continuation_dictionary_current_index)
-                            node_exists = True
-                            current_node = child_node               # Next iteration will be on the matching process on this child note
+                    r = 0                                           # Path compression: matching of the run of notes of the current node (if any)
+                    while r < len(current_node.note_run) and j < depth_limit and current_node.note_run[r].match(sub_reversed_note_sequence[j]):
+                        r += 1
+                        j += 1
+                    if r < len(current_node.note_run):              # If the sequence diverges (or ends) within the run, the node is split
+                        current_node.split(r, self.epoch)
+                    current_node.add_continuation(self.continuation_dictionary_current_index)  # Add the continuation to the continuation list of the node
+                    if j == depth_limit:                            # All notes of the sub sequence have been matched
+                        break
+                    note = sub_reversed_note_sequence[j]
+                    matching_child = None                           # we set up the initial value of a flag to know if we have found a matching node
+                    if current_node.children_list is None:          # If there is no children, then, we have met a terminating leaf
+                        current_node.children_list = []
+                    for k in range(len(current_node.children_list)):    # while iterating over the children
+                        if current_node.children_list[k].note.match(note):      # This child (exactly) matches
+                            matching_child = current_node.children_list[k].writable(self.epoch)     # Copy on write, if the child is within the snapshot
+                            current_node.children_list[k] = matching_child
                             break                                   # Successful exit from the children iterative search loop
-                    if not node_exists:                             # If no matching node has been found within children,
-                        new_child_node = PrefixTreeNode()           # then, we create and insert a new node
-                        new_child_node.note = note
-                        new_child_node.continuation_index_list = [self.continuation_dictionary_current_index]
-                        current_node.children_list.append(new_child_node)
-                        current_node = new_child_node
+                    if matching_child is None:                      # If no matching node has been found within children,
+                        current_node.children_list.append(self.new_branch(sub_reversed_note_sequence[j:depth_limit], self.continuation_dictionary_current_index))
+                        break                                       # then, we create and insert a new node (and its branch)
+                    current_node = matching_child                   # Next iteration will be on the matching process on this child note
+                    j += 1
             self.continuation_dictionary_current_index += 1
             i += 1                                                 # Continue the matching search iteration one level down
 
+    def new_branch(self, note_list, continuation_index):    # Returns a new node for the notes (from the root side), with a single continuation
+                                                            # With path compression, a single node (with a run of notes), otherwise a chain of nodes
+        node = PrefixTreeNode(self.epoch)
+        node.note = key_note(note_list[0].pitch)
+        node.continuation_index_list = [continuation_index]
+        if self.path_compression:
+            if len(note_list) > 1:
+                node.note_run = tuple([key_note(note.pitch) for note in note_list[1:]])
+        else:
+            current_node = node
+            for note in note_list[1:]:
+                child_node = PrefixTreeNode(self.epoch)
+                child_node.note = key_note(note.pitch)
+                child_node.continuation_index_list = [continuation_index]
+                current_node.children_list = [child_node]
+                current_node = child_node
+        return node
+
+    @staticmethod
+    def iterate_tree(root_dictionary, max_depth=_pseudo_infinite):
+                                            # Iterative (no recursion, thus whatever the depth) traversal of a tree, in depth first order (as displayed)
+                                            # Yields (node, level, depth): level of the node within the tree, depth (order) of its note
+                                            # (they differ with path compression, a node with a run of notes covering several depths)
+        node_stack = [(root, 0, 1) for root in reversed(list(root_dictionary.values()))]
+        while node_stack:
+            (node, level, depth) = node_stack.pop()
+            yield node, level, depth
+            child_depth = depth + 1 + len(node.note_run)
+            if node.children_list is not None and child_depth <= max_depth:
+                for child in reversed(node.children_list):
+                    node_stack.append((child, level + 1, child_depth))
+
+    def node_number(self):                  # Number of nodes of the pitch tree
+        node_number = 0
+        for dummy in self.iterate_tree(self.root_dictionary):
+            node_number += 1
+        return node_number
+
     def display_memory(self):
-         print('Memory:')
-         for dummy, root in self.root_dictionary.items():
-              self.display_tree(root, 0)
-
-    def display_tree(self, node, level):
-        indent = '  ' * level
-        print(indent, end='')
-        continuation_pitch_list = []
-        for index in node.continuation_index_list:
-            continuation_pitch_list.append(self.continuation_dictionary[index].pitch)
-        print(str(node.note.pitch) + str(continuation_pitch_list))
-        if node.children_list is not None:
-            for child in node.children_list:
-                self.display_tree(child, level + 1)
-
-    def save_memory(self):
-        print('Save memory in file PostMemory.pickle')
-        with open('PostMemory.pickle', 'wb') as post_memory_file:
-            pickle.dump([self.root_dictionary, self.continuation_dictionary], post_memory_file)
+        print('Memory:')
+        self.dump_memory()
+
+    def dump_memory(self, output_file=None, max_depth=_pseudo_infinite, min_continuation_number=0, root_key_list=None):
+                                            # Stream (line by line) a dump of the pitch tree, filtered by maximum depth, minimum number of continuations
+                                            # (the branch below a node with too few continuations being skipped, as its children have fewer) and roots
+                                            # By default, into the current standard output (resolved at call, e.g., if redirected)
+        if output_file is None:
+            output_file = sys.stdout
+        if root_key_list is None:
+            root_dictionary = self.root_dictionary
+        else:
+            root_dictionary = {}
+            for root_key in root_key_list:
+                if root_key in self.root_dictionary:
+                    root_dictionary[root_key] = self.root_dictionary[root_key]
+        skipped_level = None                # Level of the node whose branch is being skipped
+        for (node, level, depth) in self.iterate_tree(root_dictionary, max_depth):
+            if skipped_level is not None:
+                if level > skipped_level:
+                    continue
+                skipped_level = None
+            if len(node.continuation_index_list) < min_continuation_number:
+                skipped_level = level
+                continue
+            continuation_pitch_list = []
+            for index in node.continuation_index_list:
+                continuation_pitch_list.append(self.continuation_dictionary.pitch(index))
+            output_file.write('  ' * level + str(node.note.pitch) + ''.join(['-' + str(note.pitch) for note in node.note_run]) + str(continuation_pitch_list) + '\n')
+
+    def tree_statistics(self, root_dictionary):     # Statistics of a tree, computed in a single (iterative) pass
+        statistics = {'node_number': 0, 'node_number_per_depth': [], 'level_number': 0, 'max_depth': 0,
+                      'internal_node_number': 0, 'mean_branching_factor': 0., 'max_branching_factor': 0,
+                      'continuation_entry_number': 0, 'bytes': sys.getsizeof(root_dictionary)}
+        if isinstance(root_dictionary, ShardedRootDictionary):     # Sharded memory: statistics of the roots loaded (or modified) only
+            (statistics['resident_shard_number'], statistics['shard_number']) = root_dictionary.shard_statistics()
+            root_dictionary = root_dictionary.resident_dictionary()
+        children_number = 0
+        for (node, level, depth) in self.iterate_tree(root_dictionary):
+            statistics['node_number'] += 1
+            while len(statistics['node_number_per_depth']) < depth:
+                statistics['node_number_per_depth'].append(0)
+            statistics['node_number_per_depth'][depth - 1] += 1
+            statistics['level_number'] += 1 + len(node.note_run)        # Levels (depths) covered by the node
+            statistics['max_depth'] = max(statistics['max_depth'], depth + len(node.note_run))
+            statistics['continuation_entry_number'] += len(node.continuation_index_list)
+            statistics['bytes'] += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.continuation_index_list)
+            if node.note_run:
+                statistics['bytes'] += sys.getsizeof(node.note_run)
+            if node.children_list:
+                statistics['internal_node_number'] += 1
+                children_number += len(node.children_list)
+                statistics['max_branching_factor'] = max(statistics['max_branching_factor'], len(node.children_list))
+                statistics['bytes'] += sys.getsizeof(node.children_list)
+        if statistics['internal_node_number']:
+            statistics['mean_branching_factor'] = children_number / statistics['internal_node_number']
+        return statistics
+
+    def memory_statistics(self):            # Statistics of the memory (of the last snapshot, thus consistent even while training)
+                                            # Bytes are for the structures (nodes, lists, dictionaries), the notes of the nodes being shared (per pitch)
+        snapshot = self.snapshot
+        statistics = {'epoch': snapshot.epoch, 'continuation_number': snapshot.continuation_number,
+                      'continuation_bytes': self.continuation_dictionary.byte_number(), 'trees': {}}
+        for k in range(len(self.viewpoint_tree_list)):
+            if self.viewpoint_tree_list[k] is None:
+                statistics['trees']['Pitch'] = self.tree_statistics(snapshot.root_dictionary)
+            else:
+                statistics['trees'][self.viewpoint_tree_list[k].viewpoint.name] = self.tree_statistics(snapshot.viewpoint_root_dictionary_list[k])
+        return statistics
+
+    def display_memory_statistics(self):
+        statistics = self.memory_statistics()
+        print('Memory statistics (epoch ' + str(statistics['epoch']) + '): ' + str(statistics['continuation_number']) + ' continuations ('
+              + str(statistics['continuation_bytes']) + ' bytes)')
+        for (name, tree_statistics) in statistics['trees'].items():
+            print('  ' + name + ' tree: ' + str(tree_statistics['node_number']) + ' nodes (' + str(tree_statistics['level_number']) + ' levels), max depth: '
+                  + str(tree_statistics['max_depth']) + ', branching factor: ' + str(round(tree_statistics['mean_branching_factor'], 2)) + ' (mean) '
+                  + str(tree_statistics['max_branching_factor']) + ' (max), continuation entries: ' + str(tree_statistics['continuation_entry_number'])
+                  + ', ' + str(tree_statistics['bytes']) + ' bytes')
+            node_number_per_depth = tree_statistics['node_number_per_depth']
+            print('    nodes per depth: ' + str(node_number_per_depth[:_pseudo_max_order])
+                  + (' and ' + str(sum(node_number_per_depth[_pseudo_max_order:])) + ' deeper (never matched)' if len(node_number_per_depth) > _pseudo_max_order else ''))
+            if 'shard_number' in tree_statistics:
+                print('    shards loaded: ' + str(tree_statistics['resident_shard_number']) + ' of ' + str(tree_statistics['shard_number']) + ' (roots modified excepted)')
+
+    def save_memory(self, memory_file_name='PostMemory.pickle'):
+        if _sharded_memory_mode:
+            self.save_sharded_memory(os.path.splitext(memory_file_name)[0] + '.shards')
+            return
+        print('Save memory in file ' + memory_file_name)
+        with open(memory_file_name, 'wb') as post_memory_file:
+            pickle.dump(self.memory(), post_memory_file)
+
+    def memory(self):                       # Memory as saved: [root_dictionary, continuation_dictionary, {viewpoint name: root_dictionary},
+                                            # ranges of the indexes of the continuations within the window (None if all)]
+        viewpoint_root_dictionary_dictionary = {}
+        for viewpoint_tree in self.viewpoint_tree_list:
+            if viewpoint_tree is not None:
+                viewpoint_root_dictionary_dictionary[viewpoint_tree.viewpoint.name] = viewpoint_tree.root_dictionary
+        return [self.root_dictionary, self.continuation_dictionary, viewpoint_root_dictionary_dictionary, self.continuation_range_list()]
+
+    def set_memory(self, memory):
+        self.root_dictionary = memory[0]
+        self.root_pitch_list = sorted([pitch for pitch in self.root_dictionary if pitch < _chord_key_offset])
+        if isinstance(memory[1], ContinuationStore):
+            self.continuation_dictionary = memory[1]
+        else:                                                       # Memory saved (as a dictionary) before timings were quantised
+            self.continuation_dictionary = ContinuationStore()
+            for index in sorted(memory[1]):
+                self.continuation_dictionary[index] = memory[1][index]
+        self.continuation_dictionary_current_index = len(self.continuation_dictionary) + 1  # Next continuations will be added after the ones read
+        self.read_continuation_number = len(self.continuation_dictionary)
+        self.read_continuation_range_list = memory[3] if len(memory) > 3 else None     # Saved from a window
+        if len(memory) > 2:                                         # Viewpoints trees (if saved, and if used)
+            for viewpoint_tree in self.viewpoint_tree_list:
+                if viewpoint_tree is not None and viewpoint_tree.viewpoint.name in memory[2]:
+                    viewpoint_tree.root_dictionary = memory[2][viewpoint_tree.viewpoint.name]
+        self.publish_snapshot()
+
+    def tree_root_dictionary_list(self):    # Returns the list of (tree name, roots dictionary) of all trees
+        tree_root_dictionary_list = [('Pitch', self.root_dictionary)]
+        for viewpoint_tree in self.viewpoint_tree_list:
+            if viewpoint_tree is not None:
+                tree_root_dictionary_list.append((viewpoint_tree.viewpoint.name, viewpoint_tree.root_dictionary))
+        return tree_root_dictionary_list
+
+    def save_sharded_memory(self, memory_directory_name):
+                                            # Save the memory as shards: an index [continuation_dictionary, {tree name: {root key: number of nodes}},
+                                            # ranges of the indexes of the continuations within the window (None if all)] and a file per root
+                                            # (roots not loaded are loaded one after the other, thus within the same memory bound)
+        print('Save memory in directory ' + memory_directory_name)
+        os.makedirs(memory_directory_name, exist_ok=True)
+        shard_store = MemoryShardStore(memory_directory_name)
+        shard_key_dictionary_dictionary = {}
+        shard_file_name_set = {shard_store.index_file_name()}
+        for (tree_name, root_dictionary) in self.tree_root_dictionary_list():
+            shard_key_dictionary = {}
+            for key in list(root_dictionary.keys()):
+                root = root_dictionary[key]
+                shard_file_name_set.add(shard_store.shard_file_name(tree_name, key))
+                with open(shard_store.shard_file_name(tree_name, key), 'wb') as shard_file:
+                    pickle.dump(root, shard_file)
+                shard_key_dictionary[key] = 0
+                for dummy in self.iterate_tree({key: root}):
+                    shard_key_dictionary[key] += 1
+            shard_key_dictionary_dictionary[tree_name] = shard_key_dictionary
+        with open(shard_store.index_file_name(), 'wb') as index_file:
+            pickle.dump([self.continuation_dictionary, shard_key_dictionary_dictionary, self.continuation_range_list()], index_file)
+        for file_name in os.listdir(memory_directory_name):        # Shards of roots (of a previous memory) no more existing
+            if file_name.endswith('.pickle') and os.path.join(memory_directory_name, file_name) not in shard_file_name_set:
+                os.remove(os.path.join(memory_directory_name, file_name))
+
+    def read_sharded_memory(self, memory_directory_name):   # Only the index is read, each root being loaded at its first access
+        shard_store = MemoryShardStore(memory_directory_name)
+        with open(shard_store.index_file_name(), 'rb') as index_file:
+            index = pickle.load(index_file)
+        (continuation_dictionary, shard_key_dictionary_dictionary) = index[:2]
+        continuation_range_list = index[2] if len(index) > 2 else None     # Saved from a window
+        viewpoint_root_dictionary_dictionary = {}
+        for (tree_name, shard_key_dictionary) in shard_key_dictionary_dictionary.items():
+            if tree_name != 'Pitch':
+                viewpoint_root_dictionary_dictionary[tree_name] = ShardedRootDictionary(shard_store, tree_name, shard_key_dictionary)
+        self.set_memory([ShardedRootDictionary(shard_store, 'Pitch', shard_key_dictionary_dictionary['Pitch']), continuation_dictionary, viewpoint_root_dictionary_dictionary,
+                         continuation_range_list])
 
     def read_memory(self):
-        if os.path.isfile('PreMemory.pickle'):
+        if _sharded_memory_mode and os.path.isdir('PreMemory.shards'):
+            print('Read memory (index) from PreMemory.shards')
+            self.read_sharded_memory('PreMemory.shards')
+        elif os.path.isfile('PreMemory.pickle'):
             print('Read memory from PreMemory.pickle')
             with open('PreMemory.pickle', 'rb') as pre_memory_file:
-                [self.root_dictionary, self.continuation_dictionary] = pickle.load(pre_memory_file)
+                self.set_memory(pickle.load(pre_memory_file))
 
-    def generate(self, input_note_sequence):                              # Generation of a continuation sequence of MIDI messages from an input (played) sequence
-        note_sequence = self.generate_note_sequence(input_note_sequence)
+    def snapshot_memory(self, snapshot):    # Memory (as saved) of a snapshot, for the generation record
+        viewpoint_root_dictionary_dictionary = {}
+        for k in range(len(self.viewpoint_tree_list)):
+            if self.viewpoint_tree_list[k] is not None:
+                viewpoint_root_dictionary_dictionary[self.viewpoint_tree_list[k].viewpoint.name] = snapshot.viewpoint_root_dictionary_list[k]
+        continuation_dictionary = self.continuation_dictionary.truncated(snapshot.continuation_number)
+        return [snapshot.root_dictionary, continuation_dictionary, viewpoint_root_dictionary_dictionary, snapshot.continuation_range_list]
+
+    @staticmethod
+    def read_generation_record_list(generation_record_file_name):     # Returns the list of generation records [seed, input note sequence, memory, parameters]
+        generation_record_list = []
+        memory_dictionary = {}              # key: memory number, value: memory (the last recorded, as a file may hold several runs)
+        with open(generation_record_file_name, 'rb') as generation_record_file:
+            while True:
+                try:
+                    record = pickle.load(generation_record_file)
+                except EOFError:
+                    break
+                if record[0] == 'Memory':
+                    memory_dictionary[record[1]] = record[3]
+                elif record[0] == 'Generation':
+                    generation_record_list.append([record[2], record[3], memory_dictionary[record[1]], record[4]])
+                else:                       # Recorded before parameters were recorded: [seed, input note sequence, memory]
+                    generation_record_list.append(record + [None])
+        return generation_record_list
+
+    @staticmethod
+    def replay(generation_record):          # Reproduce exactly a recorded generation (e.g., to profile it offline), returns the continuation sequence
+        (seed, note_sequence, memory, parameter_dictionary) = generation_record
+        if parameter_dictionary is not None and parameter_dictionary != generation_parameter_dictionary():
+            mismatch_list = [key + ' ' + str(value) for (key, value) in parameter_dictionary.items() if generation_parameter_dictionary().get(key) != value]
+            raise RuntimeError('Generation with seed ' + str(seed) + ' has been recorded with other arguments, replay it with: ' + ', '.join(mismatch_list))
+        continuator = PrefixTreeContinuator()
+        continuator.set_memory(memory)
+        return continuator.generate_note_sequence(list(note_sequence), seed)
+
+    def generate(self, input_note_sequence, seed=None):                   # Generation of a continuation sequence of MIDI messages from an input (played) sequence
+        note_sequence = self.generate_note_sequence(input_note_sequence, seed)
         event_sequence = []
         event_time = time.time()
+        previous_note_duration = 0
         for note in note_sequence:
-            event_time = event_time + note.delta
-            event_sequence.append(NoteEvent(event_type='note_on', pitch=note.pitch, velocity=note.velocity, event_time=event_time, duration=note.duration, delta=note.delta))
-            event_sequence.append(NoteEvent(event_type='note_off', pitch=note.pitch, velocity=note.velocity, event_time=event_time + note.duration, duration=note.duration, delta=None))
+            if self.monophonic:                                     # Each note starts when the previous one ends
+                event_time = event_time + previous_note_duration
+                previous_note_duration = note.duration
+            else:                                                   # Overlaps (polyphony) reconstructed from the learnt deltas
+                event_time = event_time + note.delta
+            for component_note in note.component_note_list():      # A chord token plays all its notes
+                event_sequence.append(NoteEvent(event_type='note_on', pitch=component_note.pitch, velocity=component_note.velocity, event_time=event_time, duration=component_note.duration, delta=note.delta))
+                event_sequence.append(NoteEvent(event_type='note_off', pitch=component_note.pitch, velocity=component_note.velocity, event_time=event_time + component_note.duration, duration=component_note.duration, delta=None))
         event_sequence.sort(key = note_event_time)
         return event_sequence
 
-    def generate_note_sequence(self, note_sequence):
+    def generate_note_sequence(self, note_sequence, seed=None):
+                                                                    # The generation is reproducible from the same memory, seed and input (note_sequence)
+        if seed is None:
+            seed = self.seed_generator.getrandbits(64)
+        snapshot = self.snapshot                                    # Frozen version of the memory for this whole generation (training may go on)
+        if _generation_record_file_name and _generation_mode != 'Replay':
+            generation_recorder().record(self, snapshot, seed, list(note_sequence))
+        rng = random.Random(seed)                                   # Random generator of this generation (local, as several sessions may generate concurrently)
+        if _chord_onset_threshold:
+            note_sequence = group_chord_notes(note_sequence, _chord_onset_threshold)
+        if _pitch_region_width or _recency_bias:                    # Pitch region (around the notes played) and recency bias
+            steering = ContinuationSteering(note_sequence, snapshot.continuation_number)
+        else:
+            steering = None
         length_note_sequence = len(note_sequence)                   # Remember length of the played input sequence of notes, because note_sequence will be expanded (append)
-        last_input_note = note_sequence[-1]                         # We start with the last note of the reverse sequence: Note_N
-        self.continuation_sequence = []                             # Initialization: Assign continuation list to empty list
-        matching_child = None                                       # Declaring that flag
+        continuation_sequence = []                                  # Initialization: Assign continuation list to empty list
+                                                                    # (local, as several sessions may generate concurrently from the same memory)
+        key_sequence_list = []                                      # Keys of the notes for each viewpoint (encoded once per note), None for the pitch (main) tree
+        for viewpoint_tree in self.viewpoint_tree_list:
+            if viewpoint_tree is None:
+                key_sequence_list.append(None)
+            else:
+                key_sequence_list.append(viewpoint_tree.viewpoint.encode_sequence(note_sequence))
+        transposition = 0                                           # Current transposition (Transpose fallback), 0 if none
+        deadline = None
+        budget_note_number = 0
+        budget_truncated_note_number = 0
+        budget_direct_sample_note_number = 0
         for i in range(1, _max_continuation_notes_number + 1):
             ii = i
-            if last_input_note.pitch not in self.root_dictionary:   # If there is no matching tree root thus we cannot generate a continuation
-                if _general_default_random_generation_mode:         # If default random generation mode
-                    next_note = self.continuation_dictionary[random.randint(1, len(self.continuation_dictionary))]
-                                                                    # self.continuation_dictionary = {1: Note_1, ... , N: Note_N}
-                                                                    # len(dictionary) = number of keys or values = N
-                                                                    # random.randint(1, N) e [1, ... N]
-                    note_sequence.append(next_note)                 # Add this continuation note to the list of input notes
-                                                                    # BUG: as we add a note (on front) to the input sequence, we do not follow the max number of notes to be generated
-                    self.continuation_sequence.append(next_note)    # Add this continuation note to the list of continuations
-                    last_input_note = next_note                     # And continue the generation from this (new) last note
-                elif i == 1 and _first_continuation_default_random_generation_mode:
-                    next_note = self.continuation_dictionary[random.randint(1, len(self.continuation_dictionary))]
-                    match _generation_duration_mode:
-                        # case 'Learnt':                            If Learnt duration, do nothing specific
-                        case 'Played':
-                            if ii > len(note_sequence):
-                                ii = i - len(note_sequence)
-                            next_note.duration = note_sequence[ii - 1].duration
-                        case 'Fixed':
-                            next_note.duration = _default_fixed_duration
-                    note_sequence.append(next_note)                 # Add this continuation note to the list of input notes
-                    self.continuation_sequence.append(next_note)    # Add this continuation note to the list of continuations
-                    last_input_note = next_note                     # And continue the generation from this (new) last note
-                else:                                               # Otherwise, no continuation possible,
-                    break                                           # and we exit from loop
-            else:                                                   # Otherwise,
-                current_node = self.root_dictionary[last_input_note.pitch]
-                j = 2                                               # Set up j index for a loop for traversing the tree
+            if _note_latency_budget:                                # Anytime generation: each note has its own deadline
+                deadline = NoteDeadline(_note_latency_budget)
+            matched_node_list = self.match(note_sequence, key_sequence_list, length_note_sequence, snapshot, deadline)
+            is_fallback_allowed = _general_default_random_generation_mode or (i == 1 and _first_continuation_default_random_generation_mode)
+            note_transposition = 0
+            if not matched_node_list and transposition:            # Transpose fallback: keep on within the current transposition
+                note_transposition = transposition
+                matched_node_list = self.match_pitch(self.transpose(note_sequence[-_pseudo_max_order:], transposition), length_note_sequence, snapshot.root_dictionary, deadline)
+            if not matched_node_list and _root_fallback_mode == 'Transpose' and is_fallback_allowed:
+                (matched_node_list, note_transposition) = self.match_transposed(note_sequence, length_note_sequence, snapshot, deadline)
+            if matched_node_list:                                   # If the search is finished, we create a new continuation note
+                if deadline is not None and deadline.is_over() and not matched_node_list[-1].has_continuation_distribution():
+                    continuation_index_list = matched_node_list[-1].continuation_index_list
+                    next_note = self.continuation_dictionary[continuation_index_list[int(rng.random() * len(continuation_index_list))]]
+                                                                    # Over budget: an occurrence is sampled directly (with the same probabilities)
+                                                                    # rather than building (in O(n)) the distribution of the node
+                    budget_direct_sample_note_number += 1
+                elif _generation_engine == 'Backoff':
+                    next_note = self.continuation_dictionary[self.sample_with_backoff(matched_node_list, rng, snapshot, steering)]
+                elif steering is not None:
+                    next_note = self.continuation_dictionary[steering.sample(matched_node_list[-1].continuation_distribution(self.continuation_dictionary), rng)]
+                else:
+                    next_note = self.continuation_dictionary[matched_node_list[-1].continuation_distribution(self.continuation_dictionary).sample(rng)]
+                                                                    # by sorting within the deepest matching node list of continuations
+                                                                    # as there may have several occurrences of the same note,
+                                                                    # this implements the probabilities of a Markov model
+                                                                    # (through the cached alias table of the node, in O(1))
+                transposition = note_transposition
+                if transposition:                                   # Transposed back (unless out of the MIDI range)
+                    transposed_note = next_note.transposed(-transposition)
+                    if all([_min_midi_pitch <= component_note.pitch < _max_midi_pitch for component_note in transposed_note.component_note_list()]):
+                        next_note = transposed_note
+            elif is_fallback_allowed:                               # If there is no matching tree root, if default random generation mode
+                next_note = self.continuation_dictionary[snapshot.random_continuation_index(rng)]
+                                                                    # self.continuation_dictionary: 1: Note_1, ... , N: Note_N
+                                                                    # snapshot.continuation_number = N (when the snapshot was published)
+                                                                    # rng.randint(1, N) e [1, ... N] (or within the ranges of the window)
+            else:                                                   # Otherwise, no continuation possible,
+                break                                               # and we exit from loop
+            if deadline is not None:
+                budget_note_number += 1
+                if deadline.is_truncated:
+                    budget_truncated_note_number += 1
+            match _generation_duration_mode:
+                # case 'Learnt':                                    If Learnt duration, do nothing specific
+                case 'Played':
+                    if ii > len(note_sequence):
+                        ii = i - len(note_sequence)
+                    next_note = next_note.with_duration(note_sequence[ii - 1].duration)
+                case 'Fixed':
+                    next_note = next_note.with_duration(_default_fixed_duration)
+            note_sequence.append(next_note)                         # Add this continuation note to the list of input notes
+                                                                    # and continue the generation from this (new) last note
+            continuation_sequence.append(next_note)                 # Add this continuation note to the list of continuations
+            for k in range(len(self.viewpoint_tree_list)):
+                if key_sequence_list[k] is not None:
+                    key_sequence_list[k].append(self.viewpoint_tree_list[k].viewpoint.encode(next_note, note_sequence[-2]))
+        if budget_note_number:
+            with self.budget_statistics_lock:
+                self.budget_note_number += budget_note_number
+                self.budget_truncated_note_number += budget_truncated_note_number
+                self.budget_direct_sample_note_number += budget_direct_sample_note_number
+        return continuation_sequence
+
+    def generate_best_note_sequence_list(self, note_sequence, best_number=_best_continuation_number, length=_best_continuation_length, beam_width=_beam_width):
+                                                                    # Beam search of the best_number most probable continuations of length notes within the pitch tree
+                                                                    # (each note being chosen among the distinct continuations of the deepest matching node, with its probability)
+                                                                    # Returns the list of (log probability, continuation note sequence), the most probable first
+        snapshot = self.snapshot
+        if _chord_onset_threshold:
+            note_sequence = group_chord_notes(note_sequence, _chord_onset_threshold)
+        length_note_sequence = len(note_sequence)
+        context_note_sequence = list(note_sequence[-_pseudo_max_order:])   # Only the notes which may be matched
+        beam_width = max(beam_width, best_number)
+        hypothesis_list = [(0., ())]                                # Partial continuations: (log probability, tuple of notes)
+        for i in range(length):
+            candidate_list = []
+            for (log_probability, continuation) in hypothesis_list:
+                matched_node_list = self.match_pitch((context_note_sequence + list(continuation[-_pseudo_max_order:]))[-_pseudo_max_order:], length_note_sequence, snapshot.root_dictionary)
+                                                                    # Hypotheses ending with the same notes share the nodes matched (match cache)
+                if not matched_node_list:                           # No continuation possible, the hypothesis is abandoned
+                    continue
+                distribution = matched_node_list[-1].continuation_distribution(self.continuation_dictionary)    # Cached within the node
+                log_probability_list = distribution.log_probabilities()
+                for k in range(len(log_probability_list)):
+                    candidate_list.append((log_probability + log_probability_list[k], continuation, distribution.index_list_list[k][0]))
+                                                                    # Continuation extended (lazily) with the first occurrence of the distinct continuation
+            hypothesis_list = []
+            for (log_probability, continuation, continuation_index) in heapq.nlargest(beam_width, candidate_list, key=lambda candidate: candidate[0]):
+                hypothesis_list.append((log_probability, continuation + (self.continuation_dictionary[continuation_index],)))
+            if not hypothesis_list:
+                break
+        best_note_sequence_list = []
+        for (log_probability, continuation) in hypothesis_list[:best_number]:
+            if len(continuation) == length:
+                best_note_sequence_list.append((log_probability, list(continuation)))
+        return best_note_sequence_list
+
+    def successor_masks(self, snapshot):   # Returns the order 1 transitions of the snapshot, as bit sets of pitches (by root pitch)
+        if snapshot.successor_mask_dictionary is None:
+            successor_mask_dictionary = {}
+            for (pitch, root) in snapshot.root_dictionary.items():
+                if pitch < _chord_key_offset:
+                    successor_mask_dictionary[pitch] = pitch_mask(root.continuation_distribution(self.continuation_dictionary).pitch_list)
+            snapshot.successor_mask_dictionary = successor_mask_dictionary
+        return snapshot.successor_mask_dictionary
+
+    def generate_constrained_note_sequence(self, note_sequence, length, constraint_list=None, seed=None):
+                                                                    # Markov constraints: generation of a continuation of exactly length notes, the pitch of its note i being within
+                                                                    # constraint_list[i] (unary constraint, e.g., pitch_range_domain or pitch_class_domain), if not None
+                                                                    # The domains (bit sets of pitches) of the positions are first filtered (arc consistency) along the chain of order 1 transitions,
+                                                                    # forward then backward, thus each pitch left has some continuation within the next domain: the sampling
+                                                                    # (each note from the deepest matching node with continuations within its domain, at least the root) never backtracks
+                                                                    # Returns the continuation, or an empty list if the constraints cannot be satisfied
+        if _chord_onset_threshold:
+            raise RuntimeError('Constrained generation does not support chord tokens (--c).')
+        if seed is None:
+            seed = self.seed_generator.getrandbits(64)
+        rng = random.Random(seed)
+        snapshot = self.snapshot
+        successor_mask_dictionary = self.successor_masks(snapshot)
+        domain_mask_list = []
+        for i in range(length):
+            if constraint_list is None or constraint_list[i] is None:
+                domain_mask_list.append((1 << (_max_midi_pitch + 1)) - 1)
+            else:
+                domain_mask_list.append(pitch_mask(constraint_list[i]))
+        is_first_note_random = note_sequence[-1].pitch not in successor_mask_dictionary
+        if is_first_note_random and not _first_continuation_default_random_generation_mode:
+            return []
+        if length and not is_first_note_random:                     # The first note is a continuation of the last note played
+            domain_mask_list[0] &= successor_mask_dictionary[note_sequence[-1].pitch]
+        for i in range(length - 1):                                 # Forward filtering: pitches which are a continuation of some pitch of the previous domain
+            reachable_mask = 0
+            for (pitch, successor_mask) in successor_mask_dictionary.items():
+                if domain_mask_list[i] >> pitch & 1:
+                    reachable_mask |= successor_mask
+            domain_mask_list[i + 1] &= reachable_mask
+        for i in range(length - 2, -1, -1):                         # Backward filtering: pitches with some continuation within the next domain
+            supported_mask = 0
+            for (pitch, successor_mask) in successor_mask_dictionary.items():
+                if domain_mask_list[i] >> pitch & 1 and successor_mask & domain_mask_list[i + 1]:
+                    supported_mask |= 1 << pitch
+            domain_mask_list[i] = supported_mask
+        if not all(domain_mask_list):                               # Some domain is empty: the constraints cannot be satisfied
+            return []
+        note_sequence = list(note_sequence)
+        length_note_sequence = len(note_sequence)
+        continuation_sequence = []
+        for i in range(length):
+            domain_mask = domain_mask_list[i]
+            if i == 0 and is_first_note_random:                     # Random generation (among continuations within the domain)
+                index_list = [index for index in snapshot.continuation_indexes() if domain_mask >> self.continuation_dictionary.pitch(index) & 1]
+                if not index_list:
+                    return []
+                next_note = self.continuation_dictionary[index_list[int(rng.random() * len(index_list))]]
+            else:
+                for node in reversed(self.match_pitch(note_sequence, length_note_sequence, snapshot.root_dictionary)):
+                    distribution = node.continuation_distribution(self.continuation_dictionary)
+                    k_list = [k for k in range(len(distribution.pitch_list)) if domain_mask >> distribution.pitch_list[k] & 1]
+                    if k_list:                                      # The deepest node with continuations within the domain
+                        break
+                r = rng.random() * sum([distribution.count_list[k] for k in k_list])
+                for k in k_list:                                    # Continuations within the domain, with probabilities (renormalized) of their occurrences
+                    r -= distribution.count_list[k]
+                    if r < 0:
+                        break
+                index_list = distribution.index_list_list[k]
+                next_note = self.continuation_dictionary[index_list[int(rng.random() * len(index_list))]]
+            note_sequence.append(next_note)
+            continuation_sequence.append(next_note)
+        return continuation_sequence
+
+    def match(self, note_sequence, key_sequence_list, length_note_sequence, snapshot, deadline=None):
+                                                                    # Returns the list of the nodes matching the end of the input sequence, from the root (order 1) to the deepest one,
+                                                                    # for the first viewpoint (in fallback order) with a matching root, or an empty list
+        for k in range(len(self.viewpoint_tree_list)):
+            if self.viewpoint_tree_list[k] is None:
+                matched_node_list = self.match_pitch(note_sequence, length_note_sequence, snapshot.root_dictionary, deadline)
+            else:
+                matched_node_list = self.viewpoint_tree_list[k].match(key_sequence_list[k], length_note_sequence, snapshot.viewpoint_root_dictionary_list[k], deadline)
+            if matched_node_list:
+                return matched_node_list
+        return []
+
+    def match_transposed(self, note_sequence, length_note_sequence, snapshot, deadline=None):
+                                                                    # Transpose fallback: returns the list of the nodes matching the end of the input sequence
+                                                                    # transposed to the nearest root, and the transposition (or an empty list and 0)
+        root_pitch = snapshot.nearest_root_pitch(note_sequence[-1].pitch)
+        if root_pitch is None:
+            return [], 0
+        transposition = root_pitch - note_sequence[-1].pitch
+        transposed_note_sequence = self.transpose(note_sequence[-_pseudo_max_order:], transposition)    # Only the notes which may be matched
+        return self.match_pitch(transposed_note_sequence, length_note_sequence, snapshot.root_dictionary, deadline), transposition
+
+    def match_cache(self):                  # Returns the cache of matched nodes of the current thread (or None if no cache)
+        if not _match_cache_size:
+            return None
+        match_cache = getattr(self.match_cache_local, 'match_cache', None)
+        if match_cache is None:
+            match_cache = MatchCache(_match_cache_size)
+            self.match_cache_local.match_cache = match_cache
+            self.match_cache_registry.register(match_cache)
+        return match_cache
+
+    def match_cache_statistics(self):       # Returns number of hits and of misses, of all threads
+        return self.match_cache_registry.statistics()
+
+    def display_match_cache_statistics(self):
+        (hits_number, misses_number) = self.match_cache_statistics()
+        if hits_number + misses_number:
+            print('Match cache: ' + str(hits_number) + ' hits, ' + str(misses_number) + ' misses, hit rate: '
+                  + str(round(hits_number * 100 / (hits_number + misses_number), 1)) + '%')
+
+    def budget_statistics(self):            # Returns numbers of notes generated within a latency budget, of truncated matches and of direct samplings
+        with self.budget_statistics_lock:
+            return self.budget_note_number, self.budget_truncated_note_number, self.budget_direct_sample_note_number
+
+    def display_budget_statistics(self):
+        (budget_note_number, budget_truncated_note_number, budget_direct_sample_note_number) = self.budget_statistics()
+        if budget_note_number:
+            print('Latency budget (' + str(round(_note_latency_budget * 1000, 3)) + ' ms/note): ' + str(budget_note_number) + ' notes, '
+                  + str(budget_truncated_note_number) + ' truncated matches (' + str(round(budget_truncated_note_number * 100 / budget_note_number, 1)) + '%), '
+                  + str(budget_direct_sample_note_number) + ' direct samplings')
+
+    def match_pitch(self, note_sequence, length_note_sequence, root_dictionary, deadline=None):  # Match within the pitch (main) tree
+        if note_sequence[-1].pitch not in root_dictionary:          # If there is no matching tree root thus we cannot generate a continuation
+            return []
+        match_cache = self.match_cache()
+        if match_cache is not None:                                 # The match only depends on the last pitches (as many as the deepest level possible)
+            context = tuple([note.pitch for note in note_sequence[-max(1, min(length_note_sequence - 1, _pseudo_max_order)):]])
+            matched_node_list = match_cache.get(context, root_dictionary)
+            if matched_node_list is not None:
+                return matched_node_list
+        current_node = root_dictionary[note_sequence[-1].pitch]   # We start with the last note of the reverse sequence: Note_N
+        matched_node_list = [current_node]                          # Nodes matched during the traversal, from order 1 (root) to the deepest one
+        j = 2                                                       # Set up j index for a loop for traversing the tree
                                                                     # j is the index of the jth last note of the input sequence
                                                                     # and also the level within the tree
                                                                     # Thus initially, j = 2 : starting with children from the root node to match penultimate note
-                while current_node.children_list is not None and j < length_note_sequence:
+        r = 0                                                       # Path compression: position within the run of notes of the current node
+        while j < length_note_sequence and j <= _pseudo_max_order:
                                                                     # Iteration to traverse the tree, with at each level (j),
                                                                     # looking for a node matching corresponding note (last jth) of the input sequence
                                                                     # The stop condition is:
-                                                                    # a) current node is a leaf (with no children)
+                                                                    # a) current node is a leaf (with no children, and no more notes within its run)
                                                                     # or b) j >= length of sequence of notes (i.e. we already parsed all notes of the input sequence)
-                    matching_child = None                           # Assign a flag to know if we have found a matching node within children
-                    for child in current_node.children_list:        # Iterate over children nodes to look for a node matching jth last note from input sequence
-                        if child.note.match(note_sequence[-j]):       # If one matches it
-                            matching_child = child                  # then, remember which it is
-                            break                                   # and exit from this children iteration loop
-                    if matching_child is None:                      # If none of the children matches it,
-                        break                                       # then, exit from the traversal to stop the search
-                    else:                                           # otherwise, we continue traversing the tree
-                        current_node = matching_child               # from current child node
-                        j += 1                                      # and down one more level (and previous element of the input sequence)
-                if current_node.children_list is None or j >= length_note_sequence or j > _pseudo_max_order or matching_child is None:
-                                                                    # If the search is finished
-                                                                    # because:
-                                                                    # a) we reached a leaf,
-                                                                    # or b) we reached the end of the reverse sequence,
-                                                                    # or c) current matching has failed,
-                                                                    # then, we create a new continuation note
-                    current_node_continuation_index_list = current_node.continuation_index_list
-                    next_note = self.continuation_dictionary[current_node_continuation_index_list[random.randint(0, len(current_node_continuation_index_list) - 1)]]
-                                                                    # current_node_continuation_index_list = [index_0, ..., index_N-1]
-                                                                    # len(current_node_continuation_index_list) = N
-                                                                    # random.randint(0, N-1) e [0, ... N-1]
-                                                                    # by sorting within current node list of continuations
-                                                                    # as there may have several occurrences of the same note,
-                                                                    # this implements the probabilities of a Markov model
-                    match _generation_duration_mode:
-                        # case 'Learnt':                            If Learnt duration, do nothing specific
-                        case 'Played':
-                            if ii > len(note_sequence):
-                                ii = i - len(note_sequence)
-                            next_note.duration = note_sequence[ii - 1].duration
-                        case 'Fixed':
-                            next_note.duration = _default_fixed_duration
-                    note_sequence.append(next_note)                 # Add this continuation note to the list of input notes
-                    self.continuation_sequence.append(next_note)    # Add this continuation note to the list of continuations
-                    last_input_note = next_note                     # And continue the generation from this (new) last note
-        return self.continuation_sequence
-        
+                                                                    # or c) the pseudo maximum order has been reached
+                                                                    # or d) the deadline (if any) of the note is over (the match is truncated)
+            if deadline is not None and deadline.is_over():
+                deadline.is_truncated = True
+                break
+            if r < len(current_node.note_run):                      # The next level is within the run of the current node (with the same continuations)
+                if not current_node.note_run[r].match(note_sequence[-j]):
+                    break
+                r += 1
+            else:
+                if current_node.children_list is None:
+                    break
+                matching_child = None                               # Assign a flag to know if we have found a matching node within children
+                for child in current_node.children_list:            # Iterate over children nodes to look for a node matching jth last note from input sequence
+                    if child.note.match(note_sequence[-j]):         # If one matches it
+                        matching_child = child                      # then, remember which it is
+                        break                                       # and exit from this children iteration loop
+                if matching_child is None:                          # If none of the children matches it,
+                    break                                           # then, exit from the traversal to stop the search
+                current_node = matching_child                       # otherwise, we continue traversing the tree from current child node
+                r = 0
+            matched_node_list.append(current_node)                  # (a node with a run appears once per level matched)
+            j += 1                                                  # and down one more level (and previous element of the input sequence)
+        if match_cache is not None and (deadline is None or not deadline.is_truncated):     # A truncated match is not cached
+            match_cache.put(context, matched_node_list)
+        return matched_node_list
+
+    def sample_with_backoff(self, matched_node_list, rng, snapshot, steering=None):     # Returns the index of a continuation sampled from the blending of all matched orders
+                                                            # Starting from the deepest matched node, escape to the next lower order with the node escape probability,
+                                                            # otherwise sample from that node continuations (thus no extra traversal of the tree)
+                                                            # Escape from the root (order 1) is to order 0: all continuations (in proportion to their occurrences), within the window
+        for node in reversed(matched_node_list):
+            distribution = node.continuation_distribution(self.continuation_dictionary)
+            if rng.random() >= distribution.escape_probability:
+                if steering is not None:
+                    return steering.sample(distribution, rng)
+                return distribution.sample(rng)
+        return snapshot.random_continuation_index(rng)
+
     @staticmethod
     def play_midi_note_event(out_port, event, previous_event):
         if not previous_event:
@@ -360,93 +1832,16 @@ class PrefixTreeContinuator:                # The main class and corresponding a
         out_port.send(mido.Message(type=event.event_type, note=event.pitch, velocity=event.velocity))
 
     def listen_and_continue(self, input_port, output_port):
-        with open_input(input_port) as in_port, open_output(output_port) as out_port:
-            print('Continuator has started listening on ' + str(input_port) + ' and continuing on ' + str(output_port))
-            self.continuation_sequence = []
-            is_first_note_played = True
-            current_note_on_dict = {}           # key : pitch, value : tuple (note, note_start_time)
-            last_note_end_time = time.time()
-            continuator_stop_time = None
-            played_notes = []
-            last_event = None
-            has_been_stopped = False
-            while True:                                             # Infinite listening loop
-                for event in in_port.iter_pending():
-                    if event.type == 'note_on' and event.note == 28:        # HACK: Lowest E Yamaha SP-30
-                        print('Continuator has been stopped.')
-                        has_been_stopped = True
-                        break       # exit of the for loop
-                    elif event.type == 'note_on' and event.velocity > 0:
-                        if event.note in current_note_on_dict:
-                            print('Warning: Note ' + str(note.pitch) + ' has been repeated before being ended')
-                            continue
-                        else:           # A new note has been played
-                            if is_first_note_played:
-                                is_first_note_played = False
-                                self.play_all_pending_note_off_events(out_port, self.continuation_sequence)  # to enforce that all still on notes are to be finished
-                                self.continuation_sequence = []
-                                last_event = None
-                                delta = 0
-                            else:
-                                delta = current_time - previous_note_start_time
-                            current_time = time.time()
-                            note = Note(pitch=event.note, duration=None, velocity=event.velocity, start_time=current_time, delta=delta)
-                            current_note_on_dict[note.pitch] = (note, current_time)
-                            #if len(current_note_on_dict) >= 3:
-                                #ordered_pitch_list = sorted(list(current_note_on_dict))
-                                #chord = chordify_pitch_list(ordered_pitch_list)
-                            played_notes.append(note)
-                            previous_note_start_time = current_time
-                    elif ((event.type == 'note_off') or (event.type == 'note_on' and event.velocity == 0)) and (event.note in current_note_on_dict):
-                        current_time = time.time()                  # A note has been ended
-                        (note, note_start_time) = current_note_on_dict[event.note]
-                        del current_note_on_dict[event.note]
-                        note.duration = current_time - note_start_time
-                        last_note_end_time = current_time
-                    elif (event.type == 'note_off') or (event.type == 'note_on' and event.velocity == 0):  # An event note_off without previous note_on
-                        print('Warning: Event: ' + str(event) + ' with type: ' + str(event.type) + ' and Note: ' + str(event.note) + ' has been finished before being started')
-                    # else: Other kind of event (e.g., clock), do nothing
-                #continuator_stop_time = None
-                # Player has stopped playing (at this time)
-                player_stop_duration = time.time() - last_note_end_time  # When there is no more played notes pending events
-                if has_been_stopped:
-                    break       # exit from while loop
-                if self.continuation_sequence:                      # If still continuation note events to be played,
-                    current_event = self.continuation_sequence.pop(0)
-                    self.play_midi_note_event(out_port=out_port, event=current_event, previous_event=last_event)     # then, play the first one (and remove it)
-                    last_event = current_event
-                    if not self.continuation_sequence:  # If continuation sequence empty,
-                        continuator_stop_time = time.time()  # mark starting time for monitoring end of activity
-                elif played_notes and not current_note_on_dict and player_stop_duration > _player_stop_continuator_start_threshold:  # otherwise, if notes have been played, all notes on have been ended, and player has stopped playing
-                    save_played_notes(played_notes)
-                    self.train(played_notes)                   # then, train from played notes (if any)
-                    if _max_played_notes_considered:
-                        self.continuation_sequence = self.generate(played_notes[-_max_played_notes_considered:])
-                    else:
-                        self.continuation_sequence = self.generate(played_notes)
-                    played_notes = []
-                    is_first_note_played = True
-                    if not self.continuation_sequence:
-                        print("Generation failed.")
-                        continuator_stop_time = time.time()
-                    else:
-                        continuator_stop_time = None
-                elif continuator_stop_time and time.time() - continuator_stop_time > _player_stop_continuator_stop_threshold:  # If no activity since continuation played and no activity threshold,
-                    print('Continuator has stopped after ' + str(_player_stop_continuator_stop_threshold) + ' seconds of player inactivity.')
-                    break                                       # exit from while loop	and finish
-                elif continuator_stop_time == None:
-                    continuator_stop_time = time.time()
-                else:
-                    None
-                time.sleep(0.001)
-                continue
+        PlayerSession(self, input_port, output_port).listen_and_continue()
 
-    def play_all_pending_note_off_events(self, out_port, event_sequence):
-        if event_sequence:
-            if event_sequence[0]:   # the case of None (empty) first event
-                for event in event_sequence:
-                    if event.event_type == 'note_off':
-                        self.play_midi_note_event(out_port, event, None)
+    def run_sessions(self, session_list):   # Run concurrently several players sessions, each one within its own thread
+        thread_list = []
+        for session in session_list:
+            thread = threading.Thread(target=session.listen_and_continue, name='Session ' + str(session.input_port))
+            thread_list.append(thread)
+            thread.start()
+        for thread in thread_list:
+            thread.join()
 
     def batch_test(self, pitch_sequence_list):
         print('Batch test on: ' + str(pitch_sequence_list))
@@ -455,6 +1850,54 @@ class PrefixTreeContinuator:                # The main class and corresponding a
             self.train(note_sequence)
             self.display_memory()
             print('Continuation generated: ' + str(note_sequence_to_pitch_sequence(self.generate(note_sequence))))
+            constraint_list = [None] * 7 + [pitch_class_domain({pitch_sequence[-1] % 12})]    # 8 notes, the last one on the last pitch (class) played
+            print('Constrained continuation generated: ' + str(note_sequence_to_pitch_sequence(self.generate_constrained_note_sequence(note_sequence, 8, constraint_list))))
+            best_note_sequence_list = self.generate_best_note_sequence_list(note_sequence)
+            if not best_note_sequence_list:
+                print('No continuation of ' + str(_best_continuation_length) + ' notes (beam search)')
+            for (log_probability, best_note_sequence) in best_note_sequence_list:
+                print('Best continuation (probability ' + str(round(math.exp(log_probability), 4)) + '): ' + str(note_sequence_to_pitch_sequence(best_note_sequence)))
+
+    @staticmethod
+    def benchmark(note_number=2000, generation_number=200, input_length=20):
+                                            # Train and generate in monophonic and polyphonic modes, and with a path compressed (radix) tree,
+                                            # from the same random melody (a long improvisation, as a single phrase)
+                                            # All modes go through the same train and generate_note_sequence (match_pitch) hot path
+        melody_random = random.Random(0)
+        pitch_sequence = [60]
+        for i in range(note_number - 1):
+            pitch_sequence.append(min(max(pitch_sequence[-1] + melody_random.choice([-4, -2, -1, 1, 2, 4]), 36), 96))
+        for (mode_name, monophonic, path_compression) in [('monophonic', True, False), ('polyphonic', False, False), ('polyphonic radix', False, True)]:
+            continuator = PrefixTreeContinuator(monophonic=monophonic, path_compression=path_compression)
+            note_sequence = pitch_sequence_to_note_sequence(pitch_sequence)
+            start_time = time.perf_counter()
+            continuator.train(note_sequence)
+            train_time = time.perf_counter() - start_time
+            input_random = random.Random(1)             # Same inputs and seeds for all modes
+            generated_note_number = 0
+            start_time = time.perf_counter()
+            for k in range(generation_number):
+                start = input_random.randint(0, note_number - input_length)
+                generated_note_number += len(continuator.generate(note_sequence[start:start + input_length], k)) // 2      # 2 events per note
+            generation_time = time.perf_counter() - start_time
+            (hits_number, misses_number) = continuator.match_cache_statistics()
+            print('Benchmark ' + mode_name + ': nodes: ' + str(continuator.node_number()) + ', match cache hit rate: ' + str(round(hits_number * 100 / max(hits_number + misses_number, 1), 1)) + '%, train: ' + str(round(train_time * 1e6 / note_number, 1)) + ' us/note, generate: '
+                  + str(round(generation_time * 1e6 / max(generated_note_number, 1), 1)) + ' us/note (' + str(generated_note_number) + ' notes)')
+            continuator.display_budget_statistics()
+            start_time = time.perf_counter()
+            for k in range(10):
+                start = input_random.randint(0, note_number - input_length)
+                continuator.generate_best_note_sequence_list(note_sequence[start:start + input_length])
+            print('  best continuations (beam search, ' + str(_best_continuation_number) + ' of ' + str(_best_continuation_length) + ' notes, beam width ' + str(_beam_width) + '): '
+                  + str(round((time.perf_counter() - start_time) * 100, 3)) + ' ms/search')
+            constraint_list = [pitch_range_domain(48, 84)] * 63 + [pitch_class_domain({0})]    # Within a range, and ending on C
+            start_time = time.perf_counter()
+            constrained_note_number = 0
+            for k in range(10):
+                start = input_random.randint(0, note_number - input_length)
+                constrained_note_number += len(continuator.generate_constrained_note_sequence(note_sequence[start:start + input_length], 64, constraint_list, k))
+            print('  constrained continuations (64 notes, within a range and ending on C): ' + str(round((time.perf_counter() - start_time) * 100, 3)) + ' ms/continuation ('
+                  + str(constrained_note_number // 64) + ' of 10 satisfied)')
 
     @staticmethod
     def read_midi_file(midi_file_name):
@@ -504,20 +1947,224 @@ class PrefixTreeContinuator:                # The main class and corresponding a
                     output_port = mido.get_output_names()[1]    # Otherwise, connect the output port to the 2nd output port, assuming that it is some software to produce sound (e.g., AppleLogic)
                 print('MIDI ports chosen: input: ' + str(input_port) + ' output: ' + str(output_port))  # Display of MIDI ports chosen
                 self.listen_and_continue(input_port, output_port)
+            case 'MultiPlayer':     # One session per input port, each one paired with an output port
+                input_port_list = mido.get_input_names()
+                output_port_list = mido.get_output_names()
+                print('MIDI ports available: input: ' + str(input_port_list) + ' output: ' + str(output_port_list))  # Display of MIDI ports
+                if len(input_port_list) == 0:
+                    raise RuntimeError('There is no input device to produce the MIDI player event flow')
+                if len(output_port_list) == 0:
+                    raise RuntimeError('There is no output device to receive the MIDI continuation flow')
+                session_list = []
+                for k in range(len(input_port_list)):
+                    if _multi_player_memory_mode == 'Isolated' and k > 0:   # Each other player has its own memory
+                        session_continuator = PrefixTreeContinuator()
+                        session_continuator.read_memory()
+                    else:                                                   # The first player (and all players, if shared) uses this memory
+                        session_continuator = self
+                    output_port = output_port_list[k % len(output_port_list)]   # Output ports are reused (round robin) if less than input ports
+                    print('MIDI ports chosen: input: ' + str(input_port_list[k]) + ' output: ' + str(output_port))
+                    if _seed is None:
+                        session_seed = None
+                    else:
+                        session_seed = _seed + k                    # Each player has its own (reproducible) seeds
+                    session_list.append(PlayerSession(session_continuator, input_port_list[k], output_port, session_seed))
+                self.run_sessions(session_list)
+                for k in range(1, len(session_list)):
+                    if session_list[k].continuator is not self:
+                        session_list[k].continuator.save_memory('PostMemory' + str(k) + '.pickle')
             case 'File':
                 note_sequence = self.read_midi_file('PrePlayed.mid')
                 self.train(note_sequence)
-                if _max_played_notes_considered:
-                    self.continuation_sequence = self.generate(played_notes[-_max_played_notes_considered:])
-                else:
-                    self.continuation_sequence = self.generate(played_notes)
+                self.continuation_sequence = self.generate_note_sequence(note_sequence[-_max_played_notes_considered:])
                 self.write_midi_file('Continuation.mid', self.continuation_sequence)
+            case 'Benchmark':
+                self.benchmark()
+            case 'Replay':   # Replay of recorded generations
+                for generation_record in self.read_generation_record_list(_generation_record_file_name):
+                    start_time = time.perf_counter()
+                    continuation_sequence = self.replay(generation_record)
+                    print('Replay of generation with seed ' + str(generation_record[0]) + ' (' + str(round((time.perf_counter() - start_time) * 1000, 3)) + ' ms): '
+                          + str(note_sequence_to_pitch_sequence(generation_record[1])) + ' -> ' + str(note_sequence_to_pitch_sequence(continuation_sequence)))
             case 'Batch':    # Batch test
 #               self.batch_test([[48, 50, 52, 53], [48, 50, 50, 52], [48, 50], [50, 48], [48]])
                 self.batch_test([[48, 50, 51, 52], [48, 50, 50, 51]])
         display_metrics_history()
+        self.display_match_cache_statistics()
+        self.display_budget_statistics()
+        self.display_memory_statistics()
         self.save_memory()
 
+class MidiInputStage:                       # Fast input stage of a player: the messages received are filtered (only notes, sustain pedal and stop controls are relevant)
+                                            # and coalesced (sustain pedal messages not changing its state) within the MIDI backend thread (callback), then time stamped
+                                            # and queued within a bounded queue (consumed by the listening loop), thus floods (clock, aftertouch, controllers) cost little
+    def __init__(self, queue_size=_input_queue_size):
+        self.queue = collections.deque()    # (message, time received)
+        self.queue_size = queue_size
+        self.is_sustain_down = False
+        self.filtered_number = 0            # Number of messages filtered (not relevant)
+        self.coalesced_number = 0           # Number of sustain pedal messages coalesced
+        self.dropped_number = 0             # Number of new notes dropped (queue full)
+
+    def accept(self, message):              # Returns if a message is relevant (and not coalesced)
+        message_type = message.type
+        if message_type == 'note_on' or message_type == 'note_off':
+            return True
+        if message_type == 'control_change':
+            if message.control == _sustain_control:
+                is_sustain_down = message.value >= 64
+                if is_sustain_down == self.is_sustain_down:
+                    self.coalesced_number += 1
+                    return False
+                self.is_sustain_down = is_sustain_down
+                return True
+            if message.control in _stop_control_set:
+                return True
+        self.filtered_number += 1
+        return False
+
+    @staticmethod
+    def is_droppable(message):              # Only new notes may be dropped: ends of notes, sustain pedal and stop controls are always queued
+        return message.type == 'note_on' and message.velocity > 0 and message.note not in _stop_note_set
+
+    def receive(self, message):             # Callback of the input port (MIDI backend thread)
+        if not self.accept(message):
+            return
+        if len(self.queue) >= self.queue_size and self.is_droppable(message):
+            self.dropped_number += 1
+            return
+        self.queue.append((message, time.time()))
+
+    @staticmethod
+    def is_stop(message):
+        if message.type == 'note_on':
+            return message.velocity > 0 and message.note in _stop_note_set
+        return message.type == 'control_change' and message.control in _stop_control_set and message.value >= 64
+
+    def display_statistics(self, input_port):
+        print('Input ' + str(input_port) + ': ' + str(self.filtered_number) + ' messages filtered, ' + str(self.coalesced_number) + ' coalesced, '
+              + str(self.dropped_number) + ' notes dropped')
+
+class PlayedNoteTracker:                    # Notes played by a player (from the messages of its input stage), with sustain pedal semantics:
+                                            # a note released while the pedal is down lasts until the pedal is released (or the note is played again)
+    def __init__(self):
+        self.played_notes = []
+        self.current_note_on_dict = {}      # key : pitch, value : tuple (note, note_start_time), for notes still on (held or sustained)
+        self.sustained_pitch_set = set()    # Pitches of the notes released while the pedal is down
+        self.is_sustain_down = False
+        self.last_note_end_time = time.time()
+
+    def process(self, event, event_time):   # Returns the note started by the event, or None
+        if event.type == 'note_on' and event.velocity > 0:
+            if event.note in self.current_note_on_dict:
+                if event.note not in self.sustained_pitch_set:
+                    print('Warning: Note ' + str(event.note) + ' has been repeated before being ended')
+                    return None
+                self.end_note(event.note, event_time)       # A sustained note played again
+            if self.played_notes:
+                delta = event_time - self.played_notes[-1].start_time
+            else:
+                delta = 0
+            note = Note(pitch=event.note, duration=None, velocity=event.velocity, start_time=event_time, delta=delta)
+            self.current_note_on_dict[note.pitch] = (note, event_time)
+            self.played_notes.append(note)
+            return note
+        elif event.type == 'note_off' or event.type == 'note_on':  # (note_on with velocity 0)
+            if event.note not in self.current_note_on_dict:
+                print('Warning: Event: ' + str(event) + ' has been finished before being started')
+            elif self.is_sustain_down:
+                self.sustained_pitch_set.add(event.note)
+            else:
+                self.end_note(event.note, event_time)
+        elif event.type == 'control_change' and event.control == _sustain_control:
+            self.is_sustain_down = event.value >= 64
+            if not self.is_sustain_down:                    # Pedal released: the sustained notes are ended
+                for pitch in list(self.sustained_pitch_set):
+                    self.end_note(pitch, event_time)
+        return None
+
+    def end_note(self, pitch, event_time):
+        (note, note_start_time) = self.current_note_on_dict.pop(pitch)
+        self.sustained_pitch_set.discard(pitch)
+        note.duration = event_time - note_start_time
+        self.last_note_end_time = event_time
+
+class PlayerSession:                        # Listen and playback state of one player (pair of input and output MIDI ports)
+                                            # Several sessions may share the same memory (PrefixTreeContinuator)
+    def __init__(self, continuator, input_port, output_port, seed=None):
+        if seed is None:                                # By default, according to the arguments (--seed)
+            seed = _seed
+        self.continuator = continuator
+        self.seed_generator = random.Random(seed)       # Draws the seeds of the generations of this session
+        self.input_port = input_port
+        self.output_port = output_port
+        self.continuation_sequence = []
+
+    def listen_and_continue(self):
+        input_stage = MidiInputStage()
+        with open_input(self.input_port, callback=input_stage.receive) as in_port, open_output(self.output_port) as out_port:
+            print('Continuator has started listening on ' + str(self.input_port) + ' and continuing on ' + str(self.output_port))
+            self.continuation_sequence = []
+            played_note_tracker = PlayedNoteTracker()
+            continuator_stop_time = None
+            last_event = None
+            has_been_stopped = False
+            while True:                                             # Infinite listening loop
+                while input_stage.queue:                            # Messages received (filtered) by the input stage
+                    (event, event_time) = input_stage.queue.popleft()
+                    if input_stage.is_stop(event):
+                        print('Continuator has been stopped.')
+                        has_been_stopped = True
+                        break       # exit of the input loop
+                    if played_note_tracker.process(event, event_time) and len(played_note_tracker.played_notes) == 1:
+                        self.play_all_pending_note_off_events(out_port, self.continuation_sequence)  # First note played: to enforce that all still on notes are to be finished
+                        self.continuation_sequence = []
+                        last_event = None
+                #continuator_stop_time = None
+                # Player has stopped playing (at this time)
+                player_stop_duration = time.time() - played_note_tracker.last_note_end_time  # When there is no more played notes pending events
+                if has_been_stopped:
+                    break       # exit from while loop
+                if self.continuation_sequence:                      # If still continuation note events to be played,
+                    current_event = self.continuation_sequence.pop(0)
+                    self.continuator.play_midi_note_event(out_port=out_port, event=current_event, previous_event=last_event)     # then, play the first one (and remove it)
+                    last_event = current_event
+                    if not self.continuation_sequence:  # If continuation sequence empty,
+                        continuator_stop_time = time.time()  # mark starting time for monitoring end of activity
+                elif played_note_tracker.played_notes and not played_note_tracker.current_note_on_dict and player_stop_duration > _player_stop_continuator_start_threshold:
+                                                                    # otherwise, if notes have been played, all notes on (or sustained) have been ended, and player has stopped playing
+                    played_notes = played_note_tracker.played_notes
+                    save_played_notes(played_notes)
+                    self.continuator.train(played_notes)       # then, train from played notes (if any)
+                    if _max_played_notes_considered:
+                        self.continuation_sequence = self.continuator.generate(played_notes[-_max_played_notes_considered:], self.seed_generator.getrandbits(64))
+                    else:
+                        self.continuation_sequence = self.continuator.generate(played_notes, self.seed_generator.getrandbits(64))
+                    played_note_tracker.played_notes = []
+                    if not self.continuation_sequence:
+                        print("Generation failed.")
+                        continuator_stop_time = time.time()
+                    else:
+                        continuator_stop_time = None
+                elif continuator_stop_time and time.time() - continuator_stop_time > _player_stop_continuator_stop_threshold:  # If no activity since continuation played and no activity threshold,
+                    print('Continuator has stopped after ' + str(_player_stop_continuator_stop_threshold) + ' seconds of player inactivity.')
+                    break                                       # exit from while loop	and finish
+                elif continuator_stop_time == None:
+                    continuator_stop_time = time.time()
+                else:
+                    None
+                time.sleep(0.001)
+                continue
+        input_stage.display_statistics(self.input_port)
+
+    def play_all_pending_note_off_events(self, out_port, event_sequence):
+        if event_sequence:
+            if event_sequence[0]:   # the case of None (empty) first event
+                for event in event_sequence:
+                    if event.event_type == 'note_off':
+                        self.continuator.play_midi_note_event(out_port, event, None)
+
 # To run it:
-continuator = PrefixTreeContinuator()
-continuator.run(_generation_mode)
+if __name__ == '__main__':
+    continuator = PrefixTreeContinuator()
+    continuator.run(_generation_mode)
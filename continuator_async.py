@@ -0,0 +1,208 @@
+#from packaging.tags import PythonVersion
+
+#!/usr/bin/python
+# -*- coding: Unicode -*-
+
+# Continuator asyncio API in Python
+# The listen, train, generate and play loop as coroutines, to be embedded within an asyncio application (e.g., show control)
+# alongside other I/O: MIDI input is received without polling, output is scheduled without sleeping,
+# and training and generation (CPU) are run within an executor, thus without blocking the event loop
+# Jean-Pierre Briot
+
+# Ex (within an asyncio application):
+#   async_continuator = AsyncContinuator()
+#   await AsyncPlayerSession(async_continuator, input_port, output_port).listen_and_continue()
+
+import asyncio
+import random
+import sys
+import time
+import mido
+import continuator
+from continuator import PrefixTreeContinuator, Note, MidiInputStage, PlayedNoteTracker, \
+    _player_stop_continuator_start_threshold, _player_stop_continuator_stop_threshold, _input_queue_size
+from metrics import save_played_notes, display_metrics_history
+
+class AsyncContinuator:                     # Awaitable training and generation (within an executor) of a Continuator memory
+    def __init__(self, continuator=None, executor=None):
+        if continuator is None:
+            continuator = PrefixTreeContinuator()
+            continuator.read_memory()
+        self.continuator = continuator
+        self.executor = executor            # None for the default executor of the event loop
+
+    async def train(self, note_sequence):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.continuator.train, note_sequence)
+
+    async def generate_note_sequence(self, note_sequence, seed=None):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.continuator.generate_note_sequence, note_sequence, seed)
+
+    async def generate(self, note_sequence, seed=None):     # Returns the continuation sequence of MIDI (note) events
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.continuator.generate, note_sequence, seed)
+
+class AsyncMidiInput:                       # MIDI messages of an input port, received (by the MIDI backend callback) into an asyncio queue
+                                            # Messages are filtered and coalesced by an input stage (within the MIDI backend thread), thus floods do not reach the event loop
+    def __init__(self, input_port, queue_size=_input_queue_size):
+        loop = asyncio.get_running_loop()
+        self.input_stage = MidiInputStage(queue_size)
+        self.queue = asyncio.Queue()
+        self.port = mido.open_input(input_port, callback=lambda message: self.input_stage.accept(message) and loop.call_soon_threadsafe(self.put, message, time.time()))
+                                            # Messages are time stamped when received
+
+    def put(self, message, event_time):     # Bounded queue: beyond its size, new notes are dropped
+        if self.queue.qsize() >= self.input_stage.queue_size and self.input_stage.is_droppable(message):
+            self.input_stage.dropped_number += 1
+        else:
+            self.queue.put_nowait((message, event_time))
+
+    async def receive(self):                # Returns (message, time)
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.receive()
+
+    def close(self):
+        self.port.close()
+
+async def play_events(out_port, event_sequence):    # Scheduled output of the events (at their times, relative to the first one)
+                                                    # If cancelled (e.g., the player plays again), the notes still on are ended
+    sounding_pitch_set = set()
+    try:
+        if not event_sequence:
+            return
+        start_time = time.time()
+        first_event_time = event_sequence[0].event_time
+        for event in event_sequence:
+            delay = start_time + event.event_time - first_event_time - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            out_port.send(mido.Message(type=event.event_type, note=event.pitch, velocity=event.velocity))
+            if event.event_type == 'note_on':
+                sounding_pitch_set.add(event.pitch)
+            else:
+                sounding_pitch_set.discard(event.pitch)
+    finally:
+        for pitch in sounding_pitch_set:
+            out_port.send(mido.Message(type='note_off', note=pitch, velocity=0))
+
+class AsyncPlayerSession:                   # Same as PlayerSession (listen and playback of one player), as a coroutine
+    def __init__(self, async_continuator, input_port, output_port, seed=None):
+        if seed is None:                    # By default, according to the arguments (--seed)
+            seed = continuator._seed
+        self.async_continuator = async_continuator
+        self.seed_generator = random.Random(seed)
+        self.input_port = input_port
+        self.output_port = output_port
+
+    async def listen_and_continue(self):
+        midi_input = AsyncMidiInput(self.input_port)
+        receive_task = None
+        playback_task = None
+        try:
+            with mido.open_output(self.output_port) as out_port:
+                print('Continuator has started listening on ' + str(self.input_port) + ' and continuing on ' + str(self.output_port))
+                played_note_tracker = PlayedNoteTracker()
+                idle_start_time = time.time()       # Start of inactivity (nothing played, nor being played), None if some activity
+                while True:
+                    if receive_task is None:
+                        receive_task = asyncio.ensure_future(midi_input.receive())
+                    wait_task_set = {receive_task}
+                    if playback_task is not None:
+                        wait_task_set.add(playback_task)
+                    current_time = time.time()      # Wait for a message, the end of the playback or a silence threshold
+                    if played_note_tracker.played_notes:
+                        timeout = None if played_note_tracker.current_note_on_dict else max(0., played_note_tracker.last_note_end_time + _player_stop_continuator_start_threshold - current_time)
+                    elif idle_start_time is not None:
+                        timeout = max(0., idle_start_time + _player_stop_continuator_stop_threshold - current_time)
+                    else:
+                        timeout = None
+                    done_task_set, dummy = await asyncio.wait(wait_task_set, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if playback_task in done_task_set:
+                        playback_task = None
+                        idle_start_time = time.time()
+                    if receive_task in done_task_set:
+                        (event, event_time) = receive_task.result()
+                        receive_task = None
+                        if midi_input.input_stage.is_stop(event):
+                            print('Continuator has been stopped.')
+                            break
+                        if played_note_tracker.process(event, event_time):
+                            if len(played_note_tracker.played_notes) == 1 and playback_task is not None:     # First note played: the continuation (if playing) is stopped
+                                playback_task.cancel()
+                                playback_task = None
+                            idle_start_time = None
+                    current_time = time.time()
+                    played_notes = played_note_tracker.played_notes
+                    if played_notes and not played_note_tracker.current_note_on_dict and current_time - played_note_tracker.last_note_end_time >= _player_stop_continuator_start_threshold:
+                        save_played_notes(played_notes)
+                        await self.async_continuator.train(played_notes)
+                        continuation_sequence = await self.async_continuator.generate(played_notes[-continuator._max_played_notes_considered:], self.seed_generator.getrandbits(64))
+                        played_note_tracker.played_notes = []
+                        if continuation_sequence:
+                            playback_task = asyncio.ensure_future(play_events(out_port, continuation_sequence))
+                        else:
+                            print('Generation failed.')
+                            idle_start_time = time.time()
+                    elif not played_notes and idle_start_time is not None and current_time - idle_start_time >= _player_stop_continuator_stop_threshold:
+                        print('Continuator has stopped after ' + str(_player_stop_continuator_stop_threshold) + ' seconds of player inactivity.')
+                        break
+                if playback_task is not None:
+                    playback_task.cancel()
+                    await asyncio.gather(playback_task, return_exceptions=True)     # Notes still on are ended before closing the output port
+        finally:
+            if receive_task is not None:
+                receive_task.cancel()
+            midi_input.close()
+            midi_input.input_stage.display_statistics(self.input_port)
+
+async def run_async_sessions(async_continuator, port_pair_list):     # Run concurrently (within the event loop) the sessions of several players
+    await asyncio.gather(*[AsyncPlayerSession(async_continuator, input_port, output_port).listen_and_continue() for (input_port, output_port) in port_pair_list])
+
+class RecordingOutputPort:                  # Stand-in output port (for test), recording the messages sent with their times
+    def __init__(self):
+        self.message_list = []
+
+    def send(self, message):
+        self.message_list.append((message, time.time()))
+
+async def test_async(pitch_list=[48, 50, 52, 53, 52, 50, 48, 50, 52]):    # Test without MIDI devices: training, generation and scheduled playback
+    note_list = []
+    for i in range(len(pitch_list)):
+        note_list.append(Note(pitch=pitch_list[i], duration=0.1, velocity=64, start_time=i * 0.1, delta=0.1 if i else 0.))
+    async_continuator = AsyncContinuator(PrefixTreeContinuator())
+    await async_continuator.train(note_list)
+    event_sequence = await async_continuator.generate(note_list[:3], 1)
+    out_port = RecordingOutputPort()
+    ticks_number = 0
+    playback_task = asyncio.ensure_future(play_events(out_port, event_sequence[:16]))
+    while not playback_task.done():         # The event loop is not blocked by the playback
+        await asyncio.sleep(0.01)
+        ticks_number += 1
+    lateness_list = []
+    for k in range(len(out_port.message_list)):
+        lateness_list.append((out_port.message_list[k][1] - out_port.message_list[0][1]) - (event_sequence[k].event_time - event_sequence[0].event_time))
+    print('Played (first events): ' + str([(message.type, message.note) for (message, dummy) in out_port.message_list]))
+    print('Event loop ticks during playback: ' + str(ticks_number) + ', maximum lateness: ' + str(round(max(lateness_list) * 1000, 3)) + ' ms')
+
+if __name__ == '__main__':
+    continuator.configure(['--m', 'Batch'] + [argument for argument in sys.argv[1:] if argument != '--test'])  # The Continuator arguments (e.g., --t or --o)
+    if '--test' in sys.argv:
+        asyncio.run(test_async())
+        sys.exit()
+    input_port_list = mido.get_input_names()
+    output_port_list = mido.get_output_names()
+    if len(input_port_list) == 0:
+        raise RuntimeError('There is no input device to produce the MIDI player event flow')
+    if len(output_port_list) == 0:
+        raise RuntimeError('There is no output device to receive the MIDI continuation flow')
+    async_continuator = AsyncContinuator()
+    port_pair_list = []
+    for k in range(len(input_port_list)):   # As MultiPlayer mode (with a shared memory)
+        port_pair_list.append((input_port_list[k], output_port_list[k % len(output_port_list)]))
+    print('MIDI ports chosen: ' + str(port_pair_list))
+    asyncio.run(run_async_sessions(async_continuator, port_pair_list))
+    display_metrics_history()
+    async_continuator.continuator.save_memory()
@@ -0,0 +1,268 @@
+#from packaging.tags import PythonVersion
+
+#!/usr/bin/python
+# -*- coding: Unicode -*-
+
+# Continuator service in Python
+# Resident Continuator (memory kept warm) serving train and generate requests over a local socket (TCP or Unix)
+# Jean-Pierre Briot
+
+# Protocol (binary, big endian):
+# request:  header (opcode: 1 byte, request id: 4 bytes, number of notes: 2 bytes) + notes
+# reply:    header (opcode of the request or error: 1 byte, request id: 4 bytes, number of notes: 2 bytes) + notes (or statistics)
+# note:     pitch: 1 byte, velocity: 1 byte, duration: float 4 bytes, delta: float 4 bytes (chord tokens, with --c, are sent as their notes)
+# A client may send (pipeline) several requests without waiting for the replies, which are sent back in the same order.
+
+import argparse
+import os
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import continuator
+from continuator import PrefixTreeContinuator, Note
+
+# constants
+_header_struct = struct.Struct('!BIH')
+_note_struct = struct.Struct('!BBff')
+_statistics_struct = struct.Struct('!QQQd')   # number of requests, of notes trained, of notes generated, elapsed time
+_max_notes_number = 65535                    # Maximum number of notes within a request (2 bytes)
+_opcode_train = 1
+_opcode_generate = 2
+_opcode_statistics = 3
+_opcode_error = 255
+_write_buffer_size = 65536
+
+# call arguments (the Continuator arguments, e.g., --t or --o, are also accepted)
+parser = argparse.ArgumentParser(allow_abbrev=False)   # No abbreviations, otherwise Continuator arguments would be taken (e.g., --t for --test, or --p for --port)
+parser.add_argument('--host', dest='arg_key_host', default='localhost', type=str, help='Host of the TCP socket (default = localhost)')
+parser.add_argument('--port', dest='arg_key_port', default=5555, type=int, help='Port of the TCP socket (default = 5555)')
+parser.add_argument('--unix', dest='arg_key_unix_socket_path', default=None, type=str, help='Path of a Unix socket to be used instead of a TCP socket')
+parser.add_argument('--test', dest='arg_key_test', action='store_true', help='Run a test on localhost with a stand-in client, then exit')
+
+def encode_note_sequence(note_sequence):
+    if len(note_sequence) > _max_notes_number:
+        raise RuntimeError('Too many notes (' + str(len(note_sequence)) + ') for a request, maximum is ' + str(_max_notes_number))
+    buffer = bytearray(len(note_sequence) * _note_struct.size)
+    offset = 0
+    for note in note_sequence:
+        _note_struct.pack_into(buffer, offset, note.pitch, note.velocity, note.duration or 0., note.delta or 0.)
+        offset += _note_struct.size
+    return bytes(buffer)
+
+def decode_note_sequence(payload):
+    note_sequence = []
+    start_time = 0.
+    for (pitch, velocity, duration, delta) in _note_struct.iter_unpack(payload):
+        start_time = start_time + delta                 # Start times are rebuilt from deltas (train recomputes deltas from start times)
+        note_sequence.append(Note(pitch=pitch, duration=duration, velocity=velocity, start_time=start_time, delta=delta))
+    return note_sequence
+
+def expand_chord_notes(note_sequence):      # Chord tokens (with --c, their keys not fitting within a pitch byte) are replaced by their notes
+    expanded_note_sequence = []
+    for note in note_sequence:
+        expanded_note_sequence.extend(note.component_note_list())
+    return expanded_note_sequence
+
+def encode_message(opcode, request_id, note_sequence):
+    return _header_struct.pack(opcode, request_id, len(note_sequence)) + encode_note_sequence(note_sequence)
+
+class ContinuatorService:                   # A Continuator memory shared by all clients, with throughput statistics
+    def __init__(self, continuator):
+        self.continuator = continuator
+        self.statistics_lock = threading.Lock()
+        self.requests_number = 0
+        self.trained_notes_number = 0
+        self.generated_notes_number = 0
+        self.start_time = time.time()
+
+    def process(self, opcode, request_id, payload):     # Returns the encoded reply to a request
+        note_sequence = decode_note_sequence(payload)
+        trained_notes_number = 0
+        generated_notes_number = 0
+        try:
+            if opcode == _opcode_train:
+                self.continuator.train(note_sequence)
+                trained_notes_number = len(note_sequence)
+                reply = encode_message(_opcode_train, request_id, [])
+            elif opcode == _opcode_generate:
+                continuation_sequence = expand_chord_notes(self.continuator.generate_note_sequence(note_sequence[-continuator._max_played_notes_considered:]))
+                generated_notes_number = len(continuation_sequence)
+                reply = encode_message(_opcode_generate, request_id, continuation_sequence[:_max_notes_number])
+            elif opcode == _opcode_statistics:
+                reply = _header_struct.pack(_opcode_statistics, request_id, 0) + _statistics_struct.pack(*self.statistics())
+            else:
+                raise RuntimeError('Unknown opcode: ' + str(opcode))
+        except (RuntimeError, ValueError, IndexError, struct.error) as error:
+            print('Warning: Request ' + str(request_id) + ' failed: ' + str(error))
+            reply = encode_message(_opcode_error, request_id, [])
+        with self.statistics_lock:
+            self.requests_number += 1
+            self.trained_notes_number += trained_notes_number
+            self.generated_notes_number += generated_notes_number
+        return reply
+
+    def statistics(self):
+        with self.statistics_lock:
+            return self.requests_number, self.trained_notes_number, self.generated_notes_number, time.time() - self.start_time
+
+    def display_throughput(self):
+        (requests_number, trained_notes_number, generated_notes_number, elapsed_time) = self.statistics()
+        print('Throughput: ' + str(requests_number) + ' requests in ' + str(round(elapsed_time, 3)) + ' s: '
+              + str(round(requests_number / elapsed_time, 1)) + ' requests/s, '
+              + str(round(trained_notes_number / elapsed_time, 1)) + ' notes trained/s, '
+              + str(round(generated_notes_number / elapsed_time, 1)) + ' notes generated/s')
+
+class ContinuatorRequestHandler(socketserver.StreamRequestHandler):     # One per client connection
+    wbufsize = _write_buffer_size           # Replies are buffered and flushed only when no more requests are pending (pipelining)
+
+    def handle(self):
+        while True:
+            header = self.rfile.read(_header_struct.size)
+            if len(header) < _header_struct.size:          # Client has closed the connection
+                break
+            (opcode, request_id, notes_number) = _header_struct.unpack(header)
+            payload = self.rfile.read(notes_number * _note_struct.size)
+            if len(payload) < notes_number * _note_struct.size:
+                break
+            self.wfile.write(self.server.service.process(opcode, request_id, payload))
+            readable_list, dummy, dummy = select.select([self.connection], [], [], 0)
+            if not readable_list:                           # No more pending request, thus send back the replies
+                self.wfile.flush()
+
+class ContinuatorTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ContinuatorRequestHandler)
+        self.service = service
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class ContinuatorUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, service):
+            if os.path.exists(path):
+                os.remove(path)
+            super().__init__(path, ContinuatorRequestHandler)
+            self.service = service
+
+class ContinuatorClient:                    # Stand-in client, synchronous (train, generate) or pipelined (send_..., receive_reply)
+    def __init__(self, host='localhost', port=5555, unix_socket_path=None):
+        if unix_socket_path:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(unix_socket_path)
+        else:
+            self.socket = socket.create_connection((host, port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.socket.makefile('rb')
+        self.next_request_id = 1
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+    def send_request(self, opcode, note_sequence):     # Returns the request id
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self.socket.sendall(encode_message(opcode, request_id, note_sequence))
+        return request_id
+
+    def send_train(self, note_sequence):
+        return self.send_request(_opcode_train, note_sequence)
+
+    def send_generate(self, note_sequence):
+        return self.send_request(_opcode_generate, note_sequence)
+
+    def send_statistics(self):
+        return self.send_request(_opcode_statistics, [])
+
+    def receive_reply(self):                # Returns (opcode, request id, notes or statistics)
+        header = self.rfile.read(_header_struct.size)
+        if len(header) < _header_struct.size:
+            raise RuntimeError('Connection closed by the Continuator service')
+        (opcode, request_id, notes_number) = _header_struct.unpack(header)
+        if opcode == _opcode_statistics:
+            return opcode, request_id, _statistics_struct.unpack(self.rfile.read(_statistics_struct.size))
+        return opcode, request_id, decode_note_sequence(self.rfile.read(notes_number * _note_struct.size))
+
+    def train(self, note_sequence):
+        self.send_train(note_sequence)
+        (opcode, dummy, dummy) = self.receive_reply()
+        return opcode != _opcode_error
+
+    def generate(self, note_sequence):
+        self.send_generate(note_sequence)
+        (opcode, dummy, continuation_sequence) = self.receive_reply()
+        if opcode == _opcode_error:
+            raise RuntimeError('Generation failed on the Continuator service')
+        return continuation_sequence
+
+    def statistics(self):
+        self.send_statistics()
+        return self.receive_reply()[2]
+
+def serve(address, unix_socket_path=None, continuator=None):    # Returns the server (not yet serving)
+    if continuator is None:
+        continuator = PrefixTreeContinuator()
+        continuator.read_memory()
+    service = ContinuatorService(continuator)
+    if unix_socket_path:
+        return ContinuatorUnixServer(unix_socket_path, service)
+    else:
+        return ContinuatorTCPServer(address, service)
+
+def pitch_list_to_note_list(pitch_list):    # For test
+    note_list = []
+    for i in range(len(pitch_list)):
+        note_list.append(Note(pitch=pitch_list[i], duration=0.5, velocity=64, start_time=i * 0.5, delta=0.5 if i else 0.))
+    return note_list
+
+def test_server(requests_number=100, unix_socket_path=None):     # Test on localhost (ephemeral port or Unix socket) with a stand-in client
+    server = serve(('localhost', 0), unix_socket_path)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    if unix_socket_path:
+        client = ContinuatorClient(unix_socket_path=unix_socket_path)
+    else:
+        client = ContinuatorClient('localhost', server.server_address[1])
+    print('Train: ' + str(client.train(pitch_list_to_note_list([48, 50, 52, 53, 52, 50, 48, 50, 52]))))
+    input_note_list = pitch_list_to_note_list([48, 50, 52])
+    print('Generate (first notes): ' + str([note.pitch for note in client.generate(input_note_list)[:16]]))
+    start_time = time.time()
+    for i in range(requests_number):        # Pipelined requests
+        client.send_generate(input_note_list)
+    for i in range(requests_number):
+        client.receive_reply()
+    elapsed_time = time.time() - start_time
+    print(str(requests_number) + ' pipelined generate requests in ' + str(round(elapsed_time, 3)) + ' s: ' + str(round(requests_number / elapsed_time, 1)) + ' requests/s')
+    print('Statistics (requests, notes trained, notes generated, elapsed time): ' + str(client.statistics()))
+    client.close()
+    server.shutdown()
+    server.server_close()
+    server.service.display_throughput()
+    server.service.continuator.display_budget_statistics()
+    server.service.continuator.display_memory_statistics()
+
+if __name__ == '__main__':
+    server_args, continuator_argument_list = parser.parse_known_args()
+    continuator.configure(['--m', 'Batch'] + continuator_argument_list)    # The other arguments are the Continuator ones (an unknown one is rejected)
+    if server_args.arg_key_test:
+        test_server(unix_socket_path=server_args.arg_key_unix_socket_path)
+        sys.exit()
+    server = serve((server_args.arg_key_host, server_args.arg_key_port), server_args.arg_key_unix_socket_path)
+    print('Continuator service listening on ' + str(server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Continuator service has been stopped.')
+    finally:
+        server.server_close()
+        server.service.display_throughput()
+        server.service.continuator.display_budget_statistics()
+        server.service.continuator.display_memory_statistics()
+        server.service.continuator.save_memory()
@@ -10,11 +10,12 @@
 
 # Metrics for evaluating music played (MIDI)
 
+import heapq
 import math
 import zlib
 from collections import Counter
 import matplotlib.pyplot as plt
-from chordify import chordify, pitch_sequence_to_pnote_sequence
+from chordify import chordify_pitch_class_set
 
 def shannon_entropy(sequence, base=2):
     if not sequence:
@@ -25,11 +26,26 @@ def shannon_entropy(sequence, base=2):
     entropy = -sum(p * math.log(p, base) for p in probabilities)
     return entropy
 
-def kolmogorov_complexity(sequence):
-    bytes_string = str(sequence).encode('utf-8')
-    k_length = len(zlib.compress(bytes_string))
+_compressor = zlib.compressobj()           # Initialized once, copied for each compression
+
+def kolmogorov_complexity(sequence):        # sequence of pitches or chromas (integers within [0, 255]), encoded as one byte each
+    compressor = _compressor.copy()
+    k_length = len(compressor.compress(bytes(sequence))) + len(compressor.flush())
     return k_length, k_length / len(sequence)
 
+class IncrementalComplexity:                # Complexity of a growing session, with a streaming compressor flushed after each phrase
+                                            # (thus the previous phrases are used as a dictionary for compressing the next ones)
+    def __init__(self):
+        self.compressor = _compressor.copy()
+        self.length = 0
+        self.k_length = 0
+
+    def add(self, sequence):                # Returns the complexity of the whole session so far, the one of this phrase (knowing the previous ones), and the compression ratio
+        phrase_k_length = len(self.compressor.compress(bytes(sequence))) + len(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.length += len(sequence)
+        self.k_length += phrase_k_length
+        return self.k_length, phrase_k_length, self.k_length / self.length
+
 _saved_played_notes_list = []
 
 _metrics_history = {'length': [], 'pitch_min': [], 'pitch_max': [], 'duration_min': [], 'duration_max': [], 'velocity_min': [], 'velocity_max': [],
@@ -54,8 +70,19 @@ def note_sequence_to_velocity_sequence(note_sequence):
         velocity_sequence.append(note.velocity)
     return velocity_sequence
 
-def save_played_notes(played_notes):
+_incremental_complexity = IncrementalComplexity()
+_incremental_chroma_complexity = IncrementalComplexity()
+_incremental_complexity_history = {'complexity': [], 'phrase_complexity': [], 'chroma_complexity': [], 'chroma_phrase_complexity': []}
+
+def save_played_notes(played_notes):        # Called after each phrase played, the incremental complexities are tracked in real time
     _saved_played_notes_list.append(played_notes)
+    pitch_sequence = note_sequence_to_pitch_sequence(played_notes)
+    (complexity, phrase_complexity, dummy) = _incremental_complexity.add(pitch_sequence)
+    (chroma_complexity, chroma_phrase_complexity, dummy) = _incremental_chroma_complexity.add([pitch % 12 for pitch in pitch_sequence])
+    _incremental_complexity_history['complexity'].append(complexity)
+    _incremental_complexity_history['phrase_complexity'].append(phrase_complexity)
+    _incremental_complexity_history['chroma_complexity'].append(chroma_complexity)
+    _incremental_complexity_history['chroma_phrase_complexity'].append(chroma_phrase_complexity)
 
 def compute_metrics(pitch_sequence, duration_sequence, velocity_sequence):
     chroma_sequence = []
@@ -85,6 +112,10 @@ _chroma_index_list = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#'
 
 _chroma_midi_pitch_index_list = list(range(60, 72))
 
+_chord_notes_number = 3         # Number of (most present) chromas considered for estimating a chord
+_chord_window_size = 8          # Number of notes of a window for estimating the chord track of a session
+_chord_window_hop = 4           # Number of notes between the starts of two successive windows
+
 def compute_chroma(pitch_sequence, duration_sequence):
     chroma_duration_dict = dict(zip(_chroma_index_list, [0.] * len(_chroma_index_list)))
     for i in range(0, len(pitch_sequence)):
@@ -128,16 +159,10 @@ def display_metrics_history():
     y_list = list(range(0, len(_metrics_history['length'])))
     chord_list = []
     for y in y_list:
-        ys = list(_metrics_history['chroma'][y].values())
-        index_list = indexes_of_n_first_greatest_values(ys, 3)
-        pitch_list = []
-        for i in index_list:
-            pitch_list.append(_chroma_midi_pitch_index_list[i])
-        pitch_list.sort()
-        pnote_list = pitch_sequence_to_pnote_sequence(pitch_list)
-        chord = chordify(pnote_list)
-        chord_list.append(chord)
+        chord_list.append(estimate_chord(list(_metrics_history['chroma'][y].values())))
     print('chord_list: ' + str(chord_list))
+    print('chord_track_list: ' + str(chord_track_history()))
+    print('incremental_complexity: ' + str(_incremental_complexity_history))
     for y in y_list:
         xs = _chroma_index_list
         ys = list(_metrics_history['chroma'][y].values())
@@ -148,18 +173,48 @@ def display_metrics_history():
     ax.set_yticks(y_list)
     plt.show()
 
-def indexes_of_n_first_greatest_values(l, n):
-    index_list = []
-    for i in range(0, n):
-        vmax = 0
-        vmax_index = 0
-        for j in range(0, len(l)):
-            if l[j] > vmax:
-                vmax = l[j]
-                vmax_index = j
-        index_list.append(vmax_index)
-        l[vmax_index] = 0.
-    return index_list
+def indexes_of_n_first_greatest_values(l, n):      # Partial sort, l is not modified
+    return heapq.nlargest(n, range(len(l)), key=l.__getitem__)
+
+def estimate_chord(chroma_vector, notes_number=_chord_notes_number):
+                                                    # Chord (and extensions) of the most present chromas, or None if it cannot be named
+    index_list = indexes_of_n_first_greatest_values(chroma_vector, notes_number)
+    pitch_class_set = 0
+    for i in index_list:
+        if chroma_vector[i] > 0:
+            pitch_class_set |= 1 << i
+    return chordify_pitch_class_set(pitch_class_set)
+
+def chroma_prefix_sums(pitch_sequence, duration_sequence):
+                                                    # prefix_sum_list[c][i] = total duration of chroma c within the i first notes
+    prefix_sum_list = [[0.] * (len(pitch_sequence) + 1) for c in range(12)]
+    for i in range(len(pitch_sequence)):
+        chroma = pitch_sequence[i] % 12
+        for c in range(12):
+            prefix_sum_list[c][i + 1] = prefix_sum_list[c][i]
+        prefix_sum_list[chroma][i + 1] += duration_sequence[i]
+    return prefix_sum_list
+
+def chord_track(note_sequence, window_size=_chord_window_size, window_hop=_chord_window_hop):
+                                                    # Sequence of the chords estimated over sliding windows of notes (None if no chord)
+                                                    # Chroma vector of each window in O(12), from prefix sums
+    pitch_sequence = note_sequence_to_pitch_sequence(note_sequence)
+    duration_sequence = [duration or 0. for duration in note_sequence_to_duration_sequence(note_sequence)]
+    prefix_sum_list = chroma_prefix_sums(pitch_sequence, duration_sequence)
+    chord_sequence = []
+    start_list = list(range(0, max(len(note_sequence) - window_size, 0) + 1, window_hop))
+    if start_list[-1] + window_size < len(note_sequence):  # Last window ending with the last note (not reached by the hop)
+        start_list.append(len(note_sequence) - window_size)
+    for start in start_list:
+        end = min(start + window_size, len(note_sequence))
+        chroma_vector = [prefix_sum_list[c][end] - prefix_sum_list[c][start] for c in range(12)]
+        chord_sequence.append(estimate_chord(chroma_vector))
+    return chord_sequence
+
+def chord_track_history(note_sequence_list=None):   # Chord track of each session (phrase), by default of the played notes saved
+    if note_sequence_list is None:
+        note_sequence_list = _saved_played_notes_list
+    return [chord_track(note_sequence) for note_sequence in note_sequence_list]
 
 def test_metrics():
     #compute_metrics([69, 70, 71, 72, 73, 74, 75, 76, 77, 78, 79, 80], [1]* 12, [64,] * 12)
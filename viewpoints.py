@@ -0,0 +1,108 @@
+#from packaging.tags import PythonVersion
+
+#!/usr/bin/python
+# -*- coding: Unicode -*-
+
+# Viewpoints in Python
+# Jean-Pierre Briot
+
+# Viewpoints (attributes of notes) used by the Continuator to match sequences of notes, as in the original Continuator
+# Each viewpoint encodes a note (possibly relatively to its previous note) as a small integer key within [0, size[,
+# computed once per note, so that matching within the prefix trees only compares small integers
+
+import abc
+import bisect
+
+# constants
+_pitch_number = 129                         # MIDI pitches (0 to 128, because of transpositions)
+_interval_number = 2 * _pitch_number        # Intervals (-128 to +128) and no previous note
+_default_duration_threshold_list = [0.125, 0.25, 0.5, 1.0]     # Durations (in seconds) separating duration classes
+                                                                # Only meaningful for notes played (timed in seconds), not for notes read from MIDI files
+                                                                # (File mode, timed in ticks, thus all within the last class)
+_default_velocity_band_width = 32           # Velocity bands: 0-31, 32-63, 64-95, 96-127
+
+class Viewpoint(abc.ABC):
+    name = None
+    size = None                             # Number of possible keys
+
+    @abc.abstractmethod
+    def encode(self, note, previous_note):  # Key of a note (previous_note being None for the first note of a sequence)
+        pass
+
+    def encode_sequence(self, note_sequence):
+        key_sequence = []
+        previous_note = None
+        for note in note_sequence:
+            key_sequence.append(self.encode(note, previous_note))
+            previous_note = note
+        return key_sequence
+
+class PitchViewpoint(Viewpoint):
+    name = 'Pitch'
+    size = _pitch_number
+
+    def encode(self, note, previous_note):
+        return note.pitch
+
+class ChromaViewpoint(Viewpoint):           # Pitch class
+    name = 'Chroma'
+    size = 12
+
+    def encode(self, note, previous_note):
+        return note.pitch % 12
+
+class IntervalViewpoint(Viewpoint):         # Interval (in semitones) with previous note
+    name = 'Interval'
+    size = _interval_number
+
+    def encode(self, note, previous_note):
+        if previous_note is None:
+            return _interval_number - 1
+        return note.pitch - previous_note.pitch + _pitch_number - 1
+
+class DurationViewpoint(Viewpoint):         # Quantised duration (duration class)
+    name = 'Duration'
+
+    def __init__(self, duration_threshold_list=_default_duration_threshold_list):
+        self.duration_threshold_list = duration_threshold_list
+        self.size = len(duration_threshold_list) + 1
+
+    def encode(self, note, previous_note):
+        return bisect.bisect(self.duration_threshold_list, note.duration or 0)
+
+class VelocityViewpoint(Viewpoint):         # Velocity band
+    name = 'Velocity'
+
+    def __init__(self, velocity_band_width=_default_velocity_band_width):
+        self.velocity_band_width = velocity_band_width
+        self.size = 127 // velocity_band_width + 1
+
+    def encode(self, note, previous_note):
+        return min(note.velocity, 127) // self.velocity_band_width
+
+class CombinedViewpoint(Viewpoint):         # Combination of viewpoints (e.g., Pitch+Duration+Velocity), key in mixed radix
+    def __init__(self, viewpoint_list):
+        self.viewpoint_list = viewpoint_list
+        self.name = '+'.join([viewpoint.name for viewpoint in viewpoint_list])
+        self.size = 1
+        for viewpoint in viewpoint_list:
+            self.size = self.size * viewpoint.size
+
+    def encode(self, note, previous_note):
+        key = 0
+        for viewpoint in self.viewpoint_list:
+            key = key * viewpoint.size + viewpoint.encode(note, previous_note)
+        return key
+
+_viewpoint_class_dictionary = {'Pitch': PitchViewpoint, 'Chroma': ChromaViewpoint, 'Interval': IntervalViewpoint,
+                               'Duration': DurationViewpoint, 'Velocity': VelocityViewpoint}
+
+def viewpoint_from_name(name):              # Ex: 'Chroma' or 'Pitch+Duration+Velocity'
+    viewpoint_list = []
+    for component_name in name.split('+'):
+        if component_name not in _viewpoint_class_dictionary:
+            raise RuntimeError('Viewpoint: ' + component_name + ' should be an element within this set: {' + ', '.join(_viewpoint_class_dictionary) + '}.')
+        viewpoint_list.append(_viewpoint_class_dictionary[component_name]())
+    if len(viewpoint_list) == 1:
+        return viewpoint_list[0]
+    return CombinedViewpoint(viewpoint_list)